@@ -0,0 +1,78 @@
+import numpy as np
+from sparse_similarity import KNNGraph
+from local_search import optimize_path
+
+
+# consecutive frames below this many matches are flagged by print_order_statistics
+LOW_SIMILARITY = 100
+
+
+def band_pairs(path, windows, matched):
+    # (i, j), i < j, for every frame and the frames within its window along the path, skipping known pairs
+    n = len(path)
+    pairs = set()
+    for position, window in enumerate(windows):
+        for other in range(max(0, position - window), min(n, position + window + 1)):
+            if other == position:
+                continue
+            i, j = path[position], path[other]
+            pair = (min(i, j), max(i, j))
+            if pair not in matched:
+                pairs.add(pair)
+    return sorted(pairs)
+
+
+def refine_order_banded(approx_order, frames_data, window=5, max_window=None, method="bruteforce",
+                        low_similarity=LOW_SIMILARITY, max_rounds=4):
+    """Refine an approximate order with exact ORB matches inside a band around it.
+
+    Each frame is matched against the frames within `window` positions of it,
+    O(n * window) matches instead of O(n^2), and local search runs on that
+    banded graph. Wherever a consecutive pair of the refined path still scores
+    below low_similarity, the window of both frames doubles (up to max_window)
+    and the band is matched and searched again, until no weak link is left or
+    a wider band no longer improves the path.
+
+    Returns (path, score, graph); graph holds every matched pair.
+    """
+    from build_similarity_matrix import match_pairs
+
+    n = len(approx_order)
+    max_window = max_window or 8 * window
+    path = [int(frame) for frame in approx_order]
+    frame_windows = np.full(n, window, dtype=np.int64)
+    matched = {}
+    graph = None
+
+    print(f"\nRefining the order with ORB matches within +-{window} positions (up to +-{max_window})...")
+    for round_index in range(max_rounds):
+        pairs = band_pairs(path, frame_windows[path], matched)
+        if pairs:
+            matches = match_pairs(frames_data, pairs, method=method)
+            matched.update(zip(pairs, matches.tolist()))
+
+        keys = np.array(list(matched.keys()), dtype=np.int64).reshape(-1, 2)
+        values = np.array(list(matched.values()), dtype=np.int64)
+        degree = np.bincount(keys.ravel(), minlength=n).max() if len(keys) > 0 else 1
+        graph = KNNGraph.from_pairs(n, keys, values, k=int(max(degree, 1)))
+
+        path, moves = optimize_path(path, graph)
+        weights = np.array([graph.weight(path[p], path[p + 1]) for p in range(n - 1)], dtype=np.int64)
+        low = np.nonzero(weights < low_similarity)[0]
+        print(f"  Round {round_index + 1}: {len(matched)} pairs matched, {moves} improving moves, "
+              f"{len(low)} consecutive pairs below {low_similarity}")
+
+        if round_index > 0 and moves == 0:
+            # the wider band found nothing better: the remaining weak links are genuine (cuts, fast motion)
+            break
+        # widen around weak links; frames already at max_window cannot be helped by another round
+        flagged = np.unique(np.concatenate([np.array(path)[low], np.array(path)[low + 1]])) if len(low) > 0 \
+            else np.zeros(0, dtype=np.int64)
+        flagged = flagged[frame_windows[flagged] < max_window]
+        if len(flagged) == 0:
+            break
+        frame_windows[flagged] = np.minimum(frame_windows[flagged] * 2, max_window)
+
+    score = int(sum(graph.weight(path[p], path[p + 1]) for p in range(n - 1)))
+    print(f"  Banded refinement: {len(matched)} of {(n * (n - 1)) // 2} pairs matched, score = {score}")
+    return path, score, graph
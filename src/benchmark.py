@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+import queue as queue_module
+import numpy as np
+import cv2
+from logger import peak_rss_mb
+from parallel_similarity import worker_count
+
+
+def count_inversions(values):
+    # bottom-up merge sort, O(n log n)
+    values = list(values)
+    inversions = 0
+    width = 1
+    while width < len(values):
+        merged = []
+        for start in range(0, len(values), 2 * width):
+            left = values[start:start + width]
+            right = values[start + width:start + 2 * width]
+            i = j = 0
+            while i < len(left) and j < len(right):
+                if right[j] < left[i]:
+                    merged.append(right[j])
+                    inversions += len(left) - i
+                    j += 1
+                else:
+                    merged.append(left[i])
+                    i += 1
+            merged.extend(left[i:])
+            merged.extend(right[j:])
+        values = merged
+        width *= 2
+    return inversions
+
+
+def kendall_tau(sequence):
+    # tau between the sequence and its sorted order (no ties: positions are unique)
+    n = len(sequence)
+    if n < 2:
+        return 1.0
+    return 1.0 - 4.0 * count_inversions(sequence) / (n * (n - 1))
+
+
+def ordering_accuracy(true_positions):
+    """Compare a recovered order against the ground truth. Playing the video
+    backwards is an equally good answer, so tau is reported by magnitude."""
+    true_positions = np.asarray(true_positions)
+    tau = kendall_tau(true_positions.tolist())
+    steps = np.abs(np.diff(true_positions))
+    return {
+        'kendall_tau': round(abs(tau), 6),
+        'direction': 'forward' if tau >= 0 else 'reverse',
+        'adjacency_accuracy': round(float(np.mean(steps == 1)) if len(steps) > 0 else 1.0, 6),
+        'mean_jump': round(float(np.mean(steps)) if len(steps) > 0 else 0.0, 3)
+    }
+
+
+def record_phase(phases, name, start, items, unit):
+    elapsed = time.perf_counter() - start
+    phases[name] = {
+        'seconds': round(elapsed, 4),
+        'items': int(items),
+        'unit': unit,
+        'throughput': round(items / elapsed, 2) if elapsed > 0 else None,
+        # ru_maxrss never goes down: the case's peak so far, not this phase's own
+        'cumulative_peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def run_case(n, options, work_dir):
+    from synthetic_video import SyntheticVideo, write_jumbled_video
+    from extract_frames import extract_frames
+    from extract_features import load_and_process_frames
+    from build_similarity_matrix import build_similarity_matrix, build_similarity_graph
+    from order_frames import find_optimal_path_graph_approach, find_optimal_path_multistart, \
+        find_optimal_path_hierarchical
+    from reconstruct_video import reconstruct_video
+    from video_index import frame_number
+
+    phases = {}
+    video_path = os.path.join(work_dir, "jumbled_video.mp4")
+    frames_dir = os.path.join(work_dir, "frames")
+    os.makedirs(frames_dir)
+
+    start = time.perf_counter()
+    video = SyntheticVideo(n, width=options['width'], height=options['height'], motion=options['motion'],
+                           seed=options['seed'])
+    permutation = write_jumbled_video(video_path, video, seed=options['seed'])
+    record_phase(phases, 'generate', start, n, 'frames')
+
+    start = time.perf_counter()
+    frame_count, fps, _ = extract_frames(video_path, frames_dir, backend=options['frame_store'])
+    record_phase(phases, 'extract_frames', start, frame_count, 'frames')
+
+    start = time.perf_counter()
+    frames_data = load_and_process_frames(frames_dir, workers=options['workers'],
+                                          reduction=options['feature_reduction'],
+                                          global_descriptors=(options['method'] == "global" or
+                                                              options['global_candidates'] > 0 or
+                                                              options['hierarchical'] or options['dedup']))
+    record_phase(phases, 'features', start, len(frames_data), 'frames')
+
+    groups = None
+    if options['dedup']:
+        from near_duplicates import MIN_REPRESENTATIVES_TO_ORDER, group_near_duplicates, representative_frames, \
+            expand_order
+        start = time.perf_counter()
+        groups = group_near_duplicates(frames_data)
+        all_frames, frames_data = frames_data, representative_frames(frames_data, groups)
+        record_phase(phases, 'dedup', start, len(all_frames), 'frames')
+
+    too_few_to_order = groups is not None and len(groups) < MIN_REPRESENTATIVES_TO_ORDER
+    start = time.perf_counter()
+    candidates = None
+    compared = len(frames_data) * (len(frames_data) - 1) // 2
+    if options['candidates'] > 0 and not too_few_to_order:
+        from visual_vocabulary import generate_candidate_pairs
+        candidates = generate_candidate_pairs(frames_data, k=options['candidates'])
+        compared = len(candidates)
+    elif options['global_candidates'] > 0 and options['method'] != "global" and not too_few_to_order:
+        from global_descriptors import global_candidate_pairs
+        candidates = global_candidate_pairs(frames_data, k=options['global_candidates'])
+        compared = len(candidates)
+    if options['hierarchical'] or too_few_to_order:
+        # clusters are matched while ordering; there is no separate similarity phase
+        similarity, compared = None, 0
+    elif options['knn'] > 0:
+        similarity = build_similarity_graph(frames_data, k=options['knn'], method=options['method'],
+                                            workers=options['workers'], candidates=candidates)
+    else:
+        similarity = build_similarity_matrix(frames_data, method=options['method'], workers=options['workers'],
+                                             candidates=candidates)
+    record_phase(phases, 'similarity', start, compared, 'pairs')
+
+    start = time.perf_counter()
+    if too_few_to_order:
+        order, score = list(range(len(frames_data))), 0
+    elif options['hierarchical']:
+        order, score, _ = find_optimal_path_hierarchical(frames_data, method=options['method'],
+                                                         max_cluster_size=options['cluster_size'],
+                                                         workers=options['workers'])
+    elif options['time_budget'] > 0:
+        order, score = find_optimal_path_multistart(similarity, options['time_budget'],
+                                                    workers=options['workers'] or None)
+    else:
+        order, score = find_optimal_path_graph_approach(similarity, constructor=options['constructor'])
+    record_phase(phases, 'ordering', start, len(order), 'frames')
+    if groups is not None:
+        order, frames_data = expand_order(order, groups, all_frames), all_frames
+
+    start = time.perf_counter()
+    filenames = [frames_data[i]['filename'] for i in order]
+    reconstruct_video({'frame_filenames': filenames, 'num_frames': len(filenames)}, frames_dir,
+                      os.path.join(work_dir, "reconstructed_video.mp4"), fps=fps)
+    record_phase(phases, 'reconstruct', start, len(filenames), 'frames')
+
+    # jumbled frame k shows original frame permutation[k]
+    true_positions = [int(permutation[frame_number(name)]) for name in filenames]
+    accuracy = ordering_accuracy(true_positions)
+    accuracy['path_score'] = int(score)
+    accuracy['frames_ordered'] = len(order)
+    if groups is not None:
+        accuracy['representatives'] = len(groups)
+
+    return {
+        'frames': n,
+        'feature_reduction': options['feature_reduction'],
+        'phases': phases,
+        'accuracy': accuracy,
+        # the pipeline's own phases; generating the input is not part of it
+        'total_seconds': round(sum(p['seconds'] for name, p in phases.items() if name != 'generate'), 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def _case_process(n, options, work_dir, queue):
+    try:
+        if options['verbose']:
+            result = run_case(n, options, work_dir)
+        else:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = run_case(n, options, work_dir)
+    except Exception as e:
+        result = {'frames': n, 'feature_reduction': options['feature_reduction'], 'error': f"{type(e).__name__}: {e}"}
+    queue.put(result)
+
+
+def run_case_isolated(n, options):
+    # a fresh process per case, so peak RSS belongs to that case alone
+    work_dir = tempfile.mkdtemp(prefix=f"benchmark_{n}_r{options['feature_reduction']}_")
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_case_process, args=(n, options, work_dir, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                result = {'frames': n, 'feature_reduction': options['feature_reduction'],
+                          'error': f"case process exited with code {process.exitcode}"}
+                break
+    process.join()
+
+    if options['keep']:
+        result['work_dir'] = work_dir
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def environment_info():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    try:
+        info['git_commit'] = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        info['git_commit'] = None
+    return info
+
+
+def print_summary(results):
+    print("\n" + "=" * 100)
+    print("BENCHMARK SUMMARY")
+    print("=" * 100)
+    print(f"{'frames':>7} {'1/N':>3} {'features f/s':>13} {'matching p/s':>13} {'order f/s':>10} {'write f/s':>10} "
+          f"{'total s':>9} {'peak MB':>8} {'tau':>7} {'adjacent':>9}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['frames']:>7} {result['feature_reduction']:>3} failed: {result['error']}")
+            continue
+        phases = result['phases']
+        accuracy = result['accuracy']
+        print(f"{result['frames']:>7} {result['feature_reduction']:>3} {phases['features']['throughput']:>13.1f} "
+              f"{phases['similarity']['throughput']:>13.1f} {phases['ordering']['throughput']:>10.1f} "
+              f"{phases['reconstruct']['throughput']:>10.1f} {result['total_seconds']:>9.2f} "
+              f"{result['peak_rss_mb']:>8.1f} {accuracy['kendall_tau']:>7.4f} {accuracy['adjacency_accuracy']:>9.4f}")
+    print("=" * 100)
+
+
+def compare_reductions(results):
+    """Each reduced-resolution case against the full-resolution case of the same size:
+    feature and end-to-end speedup, and the change in ordering accuracy."""
+    baselines = {r['frames']: r for r in results if r['feature_reduction'] == 1 and 'error' not in r}
+    comparison = []
+    for result in results:
+        baseline = baselines.get(result['frames'])
+        if baseline is None or result is baseline or 'error' in result:
+            continue
+        comparison.append({
+            'frames': result['frames'],
+            'feature_reduction': result['feature_reduction'],
+            'features_speedup': round(baseline['phases']['features']['seconds'] /
+                                      max(result['phases']['features']['seconds'], 1e-9), 2),
+            'total_speedup': round(baseline['total_seconds'] / max(result['total_seconds'], 1e-9), 2),
+            'kendall_tau_change': round(result['accuracy']['kendall_tau'] - baseline['accuracy']['kendall_tau'], 6),
+            'adjacency_change': round(result['accuracy']['adjacency_accuracy'] -
+                                      baseline['accuracy']['adjacency_accuracy'], 6)
+        })
+    return comparison
+
+
+def print_reduction_comparison(comparison):
+    print("\nREDUCED-RESOLUTION FEATURES vs FULL RESOLUTION")
+    print(f"{'frames':>7} {'1/N':>3} {'features x':>11} {'total x':>8} {'tau change':>11} {'adjacent change':>16}")
+    for row in comparison:
+        print(f"{row['frames']:>7} {row['feature_reduction']:>3} {row['features_speedup']:>11.2f} "
+              f"{row['total_speedup']:>8.2f} {row['kendall_tau_change']:>+11.4f} {row['adjacency_change']:>+16.4f}")
+    print("=" * 100)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark and accuracy suite on synthetic jumbled videos")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 1000],
+                        help="Frame counts to benchmark (use --candidates/--knn for thousands of frames)")
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=180)
+    parser.add_argument("--motion", choices=("mixed", "pan", "shapes", "static"), default="mixed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--frame-store", choices=("jpeg", "raw"), default="jpeg")
+    parser.add_argument("--feature-reductions", type=int, nargs="+", choices=(1, 2, 4, 8), default=[1],
+                        help="Feature extraction resolutions to compare, e.g. 1 2 4 (1 = full resolution)")
+    parser.add_argument("--method", choices=("bruteforce", "batched", "global"), default="batched")
+    parser.add_argument("--workers", type=worker_count, default=1)
+    parser.add_argument("--candidates", type=int, default=0)
+    parser.add_argument("--global-candidates", type=int, default=0)
+    parser.add_argument("--knn", type=int, default=0)
+    parser.add_argument("--constructor", choices=("nearest_neighbor", "greedy_edge"), default="greedy_edge")
+    parser.add_argument("--time-budget", type=float, default=0)
+    parser.add_argument("--hierarchical", action="store_true")
+    parser.add_argument("--cluster-size", type=int, default=500)
+    parser.add_argument("--dedup", action="store_true",
+                        help="Match and order one representative per group of near-identical frames")
+    parser.add_argument("--output", default=None,
+                        help="Results JSON (default: benchmark_results.json in the project root)")
+    parser.add_argument("--keep", action="store_true", help="Keep each case's working directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_file = args.output or os.path.join(project_root, "benchmark_results.json")
+    options = {key: value for key, value in vars(args).items()
+               if key not in ('sizes', 'output', 'feature_reductions')}
+
+    print("=" * 60)
+    print("BENCHMARK: SYNTHETIC JUMBLED VIDEOS")
+    print("=" * 60)
+    print(f"Sizes: {args.sizes}, {args.width}x{args.height}, motion: {args.motion}, method: {args.method}")
+
+    results = []
+    for n in args.sizes:
+        for reduction in args.feature_reductions:
+            print(f"\nRunning {n} frames, features at 1/{reduction} resolution...")
+            result = run_case_isolated(n, dict(options, feature_reduction=reduction))
+            results.append(result)
+            if 'error' in result:
+                print(f"  Failed: {result['error']}")
+            else:
+                print(f"  {result['total_seconds']:.2f}s, peak {result['peak_rss_mb']:.1f} MB, "
+                      f"tau {result['accuracy']['kendall_tau']:.4f}, "
+                      f"adjacent {result['accuracy']['adjacency_accuracy']:.4f}")
+
+    comparison = compare_reductions(results)
+    report = {'environment': environment_info(), 'config': dict(options, feature_reductions=args.feature_reductions),
+              'results': results, 'reduction_comparison': comparison}
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(results)
+    if comparison:
+        print_reduction_comparison(comparison)
+    print(f"Results saved to: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,30 @@ import numpy as np
 import pickle
 from tqdm import tqdm
 import os
+import argparse
+from hamming_matcher import build_similarity_matrix_batched, pack_descriptors, match_block
+from sparse_similarity import KNNGraph
+from packed_similarity import PackedSimilarity
+from feature_store import FeatureStore, is_feature_store, locate_features
+from near_duplicates import FRAME_GROUPS_FILE, DUPLICATE_SIMILARITY, group_near_duplicates, representative_frames, \
+    save_frame_groups
+from logger import count
+from parallel_similarity import worker_count
+
+
+MATCHING_METHODS = ("bruteforce", "batched")
+# ORB matching backends plus "global": cosine similarity of per-frame global descriptors
+SIMILARITY_METHODS = MATCHING_METHODS + ("global",)
 
 
 def load_features(features_file):
     print(f"Loading features from: {features_file}")
     try:
-        with open(features_file, 'rb') as f:
-            frames_data = pickle.load(f)
+        if is_feature_store(features_file):
+            frames_data = FeatureStore(features_file)
+        else:
+            with open(features_file, 'rb') as f:
+                frames_data = pickle.load(f)
         print(f"Successfully loaded features for {len(frames_data)} frames")
         return frames_data
     except Exception as e:
@@ -30,7 +47,51 @@ def compare_frames(desc1, desc2):
         return 0
 
 
-def build_similarity_matrix(frames_data):
+def match_pairs(frames_data, pairs, method="bruteforce"):
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    matches = np.zeros(len(pairs), dtype=np.int32)
+    count('pairs_matched', len(pairs))
+
+    with tqdm(total=len(pairs), desc="Computing similarities", unit="pair") as pbar:
+        if method == "batched":
+            packed, counts = pack_descriptors(frames_data)
+            order = np.argsort(pairs[:, 0], kind='stable')
+            rows, starts = np.unique(pairs[order, 0], return_index=True)
+            for row, group in zip(rows, np.split(order, starts[1:])):
+                matches[group] = match_block(packed, counts, row, pairs[group, 1])
+                pbar.update(len(group))
+        else:
+            for k, (i, j) in enumerate(pairs):
+                matches[k] = compare_frames(frames_data[i]['descriptors'], frames_data[j]['descriptors'])
+                pbar.update(1)
+
+    return matches
+
+
+def build_similarity_matrix(frames_data, method="bruteforce", workers=1, candidates=None):
+    if method not in SIMILARITY_METHODS:
+        raise ValueError(f"Unknown matching method: {method}")
+    if method == "global":
+        # a handful of GEMMs cover every pair, so candidates and workers have nothing to save
+        from global_descriptors import global_similarity_matrix
+        count('pairs_matched', len(frames_data) * (len(frames_data) - 1) // 2)
+        return global_similarity_matrix(frames_data)
+    if candidates is not None:
+        n = len(frames_data)
+        print(f"\nBuilding {n}x{n} similarity matrix from {len(candidates)} candidate pairs...")
+        candidates = np.asarray(candidates).reshape(-1, 2)
+        similarity_matrix = np.zeros((n, n), dtype=np.int32)
+        matches = match_pairs(frames_data, candidates, method=method)
+        similarity_matrix[candidates[:, 0], candidates[:, 1]] = matches
+        similarity_matrix[candidates[:, 1], candidates[:, 0]] = matches
+        return similarity_matrix
+    count('pairs_matched', len(frames_data) * (len(frames_data) - 1) // 2)
+    if workers != 1:
+        from parallel_similarity import build_similarity_matrix_parallel
+        return build_similarity_matrix_parallel(frames_data, workers=workers, method=method)
+    if method == "batched":
+        return build_similarity_matrix_batched(frames_data)
+
     n = len(frames_data)
     similarity_matrix = np.zeros((n, n), dtype=np.int32)
     
@@ -53,10 +114,24 @@ def build_similarity_matrix(frames_data):
     return similarity_matrix
 
 
+def build_similarity_graph(frames_data, k=10, method="bruteforce", workers=1, candidates=None):
+    n = len(frames_data)
+    if candidates is not None and method != "global":
+        print(f"\nBuilding top-{k} similarity graph for {n} frames from {len(candidates)} candidate pairs...")
+        matches = match_pairs(frames_data, candidates, method=method)
+        return KNNGraph.from_pairs(n, candidates, matches, k=k)
+    
+    similarity_matrix = build_similarity_matrix(frames_data, method=method, workers=workers)
+    return KNNGraph.from_dense(similarity_matrix, k=k)
+
+
 def save_similarity_matrix(matrix, output_file):
     print(f"\nSaving similarity matrix to: {output_file}")
     try:
-        np.save(output_file, matrix)
+        if isinstance(matrix, (KNNGraph, PackedSimilarity)):
+            matrix.save(output_file)
+        else:
+            np.save(output_file, matrix)
         print("Similarity matrix saved successfully.")
         return True
     except Exception as e:
@@ -74,7 +149,10 @@ def print_matrix_statistics(similarity_matrix, frames_data):
     print(f"Total elements: {n * n}")
     print(f"Memory size: {similarity_matrix.nbytes / (1024*1024):.2f} MB")
     
-    non_diag = similarity_matrix[np.triu_indices(n, k=1)]
+    if isinstance(similarity_matrix, PackedSimilarity):
+        non_diag = similarity_matrix.values
+    else:
+        non_diag = similarity_matrix[np.triu_indices(n, k=1)]
     
     print(f"\nSimilarity scores:")
     print(f"  Minimum matches: {non_diag.min()}")
@@ -82,18 +160,76 @@ def print_matrix_statistics(similarity_matrix, frames_data):
     print(f"  Average matches: {non_diag.mean():.2f}")
     print(f"  Median matches: {np.median(non_diag):.2f}")
     
-    max_idx = np.unravel_index(similarity_matrix.argmax(), similarity_matrix.shape)
+    if isinstance(similarity_matrix, PackedSimilarity):
+        max_idx, max_value = similarity_matrix.best_pair()
+    else:
+        max_idx = np.unravel_index(similarity_matrix.argmax(), similarity_matrix.shape)
+        max_value = similarity_matrix[max_idx]
     if max_idx[0] != max_idx[1]:
         print(f"\nMost similar frames:")
         print(f"  {frames_data[max_idx[0]]['filename']} and {frames_data[max_idx[1]]['filename']}")
-        print(f"  Matches: {similarity_matrix[max_idx]}")
+        print(f"  Matches: {max_value}")
+    
+    print("=" * 60)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the frame similarity matrix")
+    parser.add_argument("--method", choices=SIMILARITY_METHODS, default="bruteforce",
+                        help="BFMatcher per pair, batched Hamming distances over blocks of frames, "
+                             "or global thumbnail/histogram descriptors compared with one GEMM")
+    parser.add_argument("--workers", type=worker_count, default=1,
+                        help="Worker processes for tiled matching (0 = all cores)")
+    parser.add_argument("--candidates", type=int, default=0,
+                        help="Match only each frame's top-K visual-vocabulary neighbours (0 = all pairs)")
+    parser.add_argument("--global-candidates", type=int, default=0,
+                        help="Match only each frame's top-K neighbours by global descriptor, so ORB "
+                             "re-ranks the cheap global ranking (0 = all pairs)")
+    parser.add_argument("--knn", type=int, default=0,
+                        help="Save a sparse top-K neighbour graph (similarity_graph.npz) instead of the dense matrix")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Fill similarity_matrix.npy on disk tile by tile, resuming an interrupted build")
+    parser.add_argument("--tile-size", type=int, default=256,
+                        help="Tile edge length for --out-of-core builds")
+    parser.add_argument("--packed", action="store_true",
+                        help="Save the upper triangle as uint16 (similarity_matrix.npz), a quarter of the dense size")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Collapse near-identical frames first and match one representative per group "
+                             "(groups saved to frame_groups.json for order_frames.py)")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="Global descriptor cosine at or above which frames count as duplicates")
+    return parser.parse_args()
+
+
+def print_graph_statistics(graph, frames_data):
+    print("\n" + "=" * 60)
+    print("SIMILARITY GRAPH STATISTICS")
+    print("=" * 60)
+    
+    n = len(graph)
+    stored = graph.weights[graph.neighbors >= 0]
+    print(f"Frames: {n}, neighbours per frame: {graph.k}")
+    print(f"Stored neighbour entries: {len(stored)} (dense would hold {n * n} entries)")
+    print(f"Memory size: {graph.nbytes / (1024*1024):.2f} MB")
+    
+    if len(stored) > 0:
+        print(f"\nSimilarity scores of stored edges:")
+        print(f"  Minimum matches: {stored.min()}")
+        print(f"  Maximum matches: {stored.max()}")
+        print(f"  Average matches: {stored.mean():.2f}")
+        
+        (i, j), best = graph.best_pair()
+        print(f"\nMost similar frames:")
+        print(f"  {frames_data[i]['filename']} and {frames_data[j]['filename']}")
+        print(f"  Matches: {best}")
     
     print("=" * 60)
 
 
-def main():
+def main(method="bruteforce", workers=1, candidates=0, knn=0, out_of_core=False, tile_size=256, packed=False,
+         global_candidates=0, dedup=False, dedup_threshold=None):
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    features_file = os.path.join(project_root, "frames_features.pkl")
+    features_file = locate_features(project_root)
     output_file = os.path.join(project_root, "similarity_matrix.npy")
     
     print("=" * 60)
@@ -111,9 +247,54 @@ def main():
         print("No frame data loaded. Exiting.")
         return
     
-    similarity_matrix = build_similarity_matrix(frames_data)
+    groups_file = os.path.join(project_root, FRAME_GROUPS_FILE)
+    if dedup:
+        # the matrix then covers representatives only; order_frames.py expands the groups again
+        threshold = dedup_threshold or DUPLICATE_SIMILARITY
+        groups = group_near_duplicates(frames_data, threshold=threshold)
+        save_frame_groups(groups, len(frames_data), groups_file, threshold=threshold)
+        frames_data = representative_frames(frames_data, groups)
+    elif os.path.exists(groups_file):
+        # groups of an earlier --dedup run do not describe a full matrix
+        os.remove(groups_file)
+    
+    if method == "global" and (candidates > 0 or global_candidates > 0 or out_of_core):
+        print("Note: --method global compares every pair in memory; ignoring candidate and out-of-core options")
+        candidates, global_candidates, out_of_core = 0, 0, False
     
-    print_matrix_statistics(similarity_matrix, frames_data)
+    candidate_pairs = None
+    if candidates > 0:
+        from visual_vocabulary import generate_candidate_pairs
+        candidate_pairs = generate_candidate_pairs(frames_data, k=candidates)
+    elif global_candidates > 0:
+        from global_descriptors import global_candidate_pairs
+        candidate_pairs = global_candidate_pairs(frames_data, k=global_candidates)
+    
+    if knn > 0:
+        output_file = os.path.join(project_root, "similarity_graph.npz")
+        similarity_matrix = build_similarity_graph(frames_data, k=knn, method=method, workers=workers,
+                                                   candidates=candidate_pairs)
+        print_graph_statistics(similarity_matrix, frames_data)
+    elif out_of_core and candidate_pairs is None and not packed:
+        from checkpointed_similarity import build_similarity_matrix_checkpointed
+        similarity_matrix = build_similarity_matrix_checkpointed(frames_data, output_file, method=method,
+                                                                 workers=workers, tile_size=tile_size)
+        print("\nPhase 4 Complete.")
+        print(f"Similarity matrix saved to: {output_file}")
+        print("\nNext Step: Use the similarity matrix to determine correct frame order.")
+        return
+    else:
+        if out_of_core and candidate_pairs is None:
+            from checkpointed_similarity import build_similarity_matrix_checkpointed
+            similarity_matrix = build_similarity_matrix_checkpointed(frames_data, output_file, method=method,
+                                                                     workers=workers, tile_size=tile_size)
+        else:
+            similarity_matrix = build_similarity_matrix(frames_data, method=method, workers=workers,
+                                                        candidates=candidate_pairs)
+        if packed:
+            output_file = os.path.join(project_root, "similarity_matrix.npz")
+            similarity_matrix = PackedSimilarity.from_dense(similarity_matrix)
+        print_matrix_statistics(similarity_matrix, frames_data)
     
     success = save_similarity_matrix(similarity_matrix, output_file)
     
@@ -126,4 +307,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(method=args.method, workers=args.workers, candidates=args.candidates, knn=args.knn,
+         out_of_core=args.out_of_core, tile_size=args.tile_size, packed=args.packed,
+         global_candidates=args.global_candidates, dedup=args.dedup, dedup_threshold=args.dedup_threshold)
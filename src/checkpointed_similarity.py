@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from multiprocessing import Pool
+from tqdm import tqdm
+from hamming_matcher import pack_descriptors
+from parallel_similarity import iter_upper_tiles, tile_pair_count, compute_tile
+from logger import count
+from profiler import start_worker_profile
+
+
+_worker_state = {}
+
+
+def manifest_path(output_file):
+    return output_file + ".manifest.json"
+
+
+def features_fingerprint(frames_data):
+    # identity of the input: a rerun against different features must start over. Keypoint
+    # counts alone survive a change of ORB parameters or reduction, so the descriptors
+    # themselves (and the frame shape ORB saw) are hashed
+    digest = hashlib.sha1()
+    for frame_info in frames_data:
+        digest.update(f"{frame_info['filename']}:{frame_info['num_keypoints']}:{tuple(frame_info['shape'])};".encode())
+        if frame_info['descriptors'] is not None:
+            digest.update(np.ascontiguousarray(frame_info['descriptors']).data)
+    return digest.hexdigest()
+
+
+def load_manifest(output_file, expected):
+    path = manifest_path(output_file)
+    if not os.path.exists(path) or not os.path.exists(output_file):
+        return None
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read checkpoint manifest ({e}), starting over")
+        return None
+
+    if any(manifest.get(key) != value for key, value in expected.items()):
+        print("Checkpoint manifest belongs to a different build, starting over")
+        return None
+    return manifest
+
+
+def save_manifest(output_file, manifest):
+    # write-then-rename so a crash never leaves a half-written manifest behind
+    path = manifest_path(output_file)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def pack_tile(frames_data, tile):
+    # only the frames a tile touches are packed, so memory follows the tile size, not n
+    r0, r1, c0, c1 = tile
+    frames = list(range(r0, r1)) if r0 == c0 else list(range(r0, r1)) + list(range(c0, c1))
+    packed, counts = pack_descriptors([frames_data[i] for i in frames])
+    offset = 0 if r0 == c0 else r1 - r0
+    return packed, counts, (0, r1 - r0, offset, offset + c1 - c0)
+
+
+def match_tile(frames_data, tile, method):
+    packed, counts, local_tile = pack_tile(frames_data, tile)
+    return compute_tile(local_tile, packed, counts, method)
+
+
+def _init_worker(frames_data, method):
+    start_worker_profile()
+    _worker_state['frames_data'] = frames_data
+    _worker_state['method'] = method
+
+
+def _run_tile(task):
+    index, tile = task
+    return index, tile, match_tile(_worker_state['frames_data'], tile, _worker_state['method'])
+
+
+def build_similarity_matrix_checkpointed(frames_data, output_file, method="bruteforce", workers=1,
+                                         tile_size=256, checkpoint_interval=30.0):
+    """Fill an on-disk (n, n) int32 .npy tile by tile. Finished tiles are recorded in
+    <output_file>.manifest.json every checkpoint_interval seconds, and a rerun with
+    the same inputs skips them. Returns the matrix as a read-only memmap."""
+    n = len(frames_data)
+    expected = {'n': n, 'tile_size': tile_size, 'method': method,
+                'features': features_fingerprint(frames_data)}
+    tiles = list(iter_upper_tiles(n, tile_size))
+
+    manifest = load_manifest(output_file, expected)
+    if manifest is None:
+        matrix = np.lib.format.open_memmap(output_file, mode='w+', dtype=np.int32, shape=(n, n))
+        manifest = dict(expected, done=[])
+        save_manifest(output_file, manifest)
+    else:
+        matrix = np.lib.format.open_memmap(output_file, mode='r+')
+
+    done = set(manifest['done'])
+    remaining = [(index, tile) for index, tile in enumerate(tiles) if index not in done]
+
+    print(f"\nBuilding {n}x{n} similarity matrix out of core: {output_file}")
+    print(f"{len(tiles)} tiles of {tile_size}x{tile_size}, {len(done)} already finished, "
+          f"checkpointing every {checkpoint_interval:.0f}s ({method})...")
+
+    def checkpoint():
+        matrix.flush()
+        manifest['done'] = sorted(done)
+        save_manifest(output_file, manifest)
+
+    pool = None
+    if workers != 1 and len(remaining) > 0:
+        workers = workers or os.cpu_count() or 1
+        pool = Pool(processes=workers, initializer=_init_worker, initargs=(frames_data, method))
+        results = pool.imap_unordered(_run_tile, remaining)
+    else:
+        results = ((index, tile, match_tile(frames_data, tile, method)) for index, tile in remaining)
+
+    last_checkpoint = time.time()
+    try:
+        with tqdm(total=sum(tile_pair_count(tile) for _, tile in remaining),
+                  desc="Computing similarities", unit="pair") as pbar:
+            for index, tile, block in results:
+                r0, r1, c0, c1 = tile
+                if r0 == c0:
+                    matrix[r0:r1, c0:c1] = block + block.T
+                else:
+                    matrix[r0:r1, c0:c1] = block
+                    matrix[c0:c1, r0:r1] = block.T
+                done.add(index)
+                pbar.update(tile_pair_count(tile))
+                count('pairs_matched', tile_pair_count(tile))
+
+                if time.time() - last_checkpoint >= checkpoint_interval:
+                    checkpoint()
+                    last_checkpoint = time.time()
+        if pool is not None:
+            # finished: let the workers exit normally so their exit hooks run
+            pool.close()
+            pool.join()
+    finally:
+        # whatever finished before an error or Ctrl-C is kept for the next run
+        checkpoint()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    del matrix
+    return np.load(output_file, mmap_mode='r')
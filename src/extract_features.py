@@ -2,56 +2,180 @@ import cv2
 import numpy as np
 import os
 import pickle
+import argparse
+from multiprocessing import Pool
 from tqdm import tqdm
+from feature_cache import FeatureCache
+from feature_store import save_feature_store
+from frame_store import JPEG_GRAY_MODES, open_frame_store
+from global_descriptors import HISTOGRAM_SIZE, global_descriptor
+from logger import count
+from parallel_similarity import worker_count
+from profiler import start_worker_profile
 
 
-def extract_orb_features(frame):
-    orb = cv2.ORB_create(nfeatures=500)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+ORB_FEATURES = 500
+
+# decode for ORB at 1/N resolution, in grayscale (1 = the full-resolution BGR path)
+FEATURE_REDUCTIONS = tuple(JPEG_GRAY_MODES)
+
+_worker_orb = None
+_worker_store = None
+_worker_reduction = 1
+_worker_with_global = False
+
+
+def create_orb_detector():
+    return cv2.ORB_create(nfeatures=ORB_FEATURES)
+
+
+def orb_parameters():
+    # everything that changes the descriptors of a frame; part of the feature cache key
+    return {'detector': 'ORB', 'nfeatures': ORB_FEATURES, 'opencv': cv2.__version__}
+
+
+def warn_if_too_small(shape, reduction):
+    # ORB ignores a 31 px border (edgeThreshold) on every pyramid level
+    if reduction > 1 and min(shape[:2]) <= 2 * create_orb_detector().getEdgeThreshold():
+        print(f"Warning: frames are only {shape[1]}x{shape[0]} at 1/{reduction} resolution; "
+              f"ORB will find few keypoints, use a smaller reduction")
+
+
+def extract_orb_features(frame, orb=None):
+    if orb is None:
+        orb = create_orb_detector()
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     keypoints, descriptors = orb.detectAndCompute(gray, None)
     return keypoints, descriptors
 
 
-def load_and_process_frames(frames_dir):
+def process_frame(store, i, orb=None, reduction=1, with_global=False):
+    # a grayscale companion array skips both the decode and the colour conversion
+    if reduction > 1:
+        frame = store.read_gray(i, reduction)
+    else:
+        frame = store.read_gray(i) if store.has_gray else store.read(i)
+
+    if frame is None:
+        return None
+
+    keypoints, descriptors = extract_orb_features(frame, orb)
+    vector = None
+    if with_global:
+        # the global descriptor needs colour for its HSV histogram, whatever ORB was fed
+        color = frame if frame.ndim == 3 else store.read_small(i, HISTOGRAM_SIZE)
+        vector = global_descriptor(color)
+
+    # keypoints stay behind: only the descriptors and their count are kept
+    return {
+        'filename': store.filenames[i],
+        'path': store.path(i),
+        'shape': store.frame_shape if store.has_gray and reduction == 1 else frame.shape,
+        'num_keypoints': len(keypoints) if keypoints else 0,
+        'descriptors': descriptors,
+        'global_descriptor': vector
+    }
+
+
+def _init_orb_worker(store, reduction=1, with_global=False):
+    global _worker_orb, _worker_store, _worker_reduction, _worker_with_global
+    start_worker_profile()
+    # one OpenCV thread per process, the pool already provides the parallelism
+    cv2.setNumThreads(1)
+    _worker_orb = create_orb_detector()
+    _worker_store = store
+    _worker_reduction = reduction
+    _worker_with_global = with_global
+
+
+def _process_frame_worker(i):
+    return process_frame(_worker_store, i, _worker_orb, _worker_reduction, _worker_with_global)
+
+
+def load_and_process_frames(frames_dir, workers=1, cache=None, reduction=1, filenames=None, global_descriptors=False):
+    # filenames restricts extraction to those frames of frames_dir (insert_frames.py); global
+    # descriptors cost a colour decode per frame, so only --method global, --global-candidates,
+    # --hierarchical and --dedup ask for them
+    if reduction not in FEATURE_REDUCTIONS:
+        raise ValueError(f"Unsupported feature reduction: {reduction}")
     print(f"Reading frames from: {frames_dir}")
-    frame_files = sorted([f for f in os.listdir(frames_dir) if f.endswith('.jpg')])
+    store = open_frame_store(frames_dir)
+    if reduction > 1:
+        print(f"Decoding grayscale at 1/{reduction} resolution for ORB")
+    frame_files = store.filenames
+    indices = list(range(len(frame_files))) if filenames is None else [store.index_of(f) for f in filenames]
 
-    if len(frame_files) == 0:
+    if len(indices) == 0:
         print("Error: No frames found in the directory.")
         return []
 
-    print(f"Found {len(frame_files)} frames to process")
-    frames_data = []
+    print(f"Found {len(indices)} frames to process")
+    processed = {}
+    cache_keys = {}
+
+    if cache is not None:
+        params = dict(orb_parameters(), **store.feature_parameters())
+        if reduction > 1:
+            params['reduction'] = reduction
+        for i in tqdm(indices, desc="Checking feature cache", unit="frame"):
+            cache_keys[i] = FeatureCache.make_key(store.cache_source(i), params)
+            cached = cache.get(cache_keys[i], with_global=global_descriptors)
+            if cached is not None:
+                processed[i] = dict(cached, filename=frame_files[i], path=store.path(i))
+        print(f"Reusing cached features for {len(processed)} frames")
+        count('feature_cache_hits', len(processed))
+
+    to_process = [i for i in indices if i not in processed]
+
+    if workers == 1:
+        orb = create_orb_detector()
+        results = (process_frame(store, i, orb, reduction, global_descriptors) for i in to_process)
+        pool = None
+    else:
+        workers = workers or os.cpu_count() or 1
+        print(f"Extracting features with {workers} worker processes")
+        pool = Pool(processes=workers, initializer=_init_orb_worker, initargs=(store, reduction, global_descriptors))
+        # imap keeps results in frame order
+        results = pool.imap(_process_frame_worker, to_process, chunksize=4)
 
-    for frame_file in tqdm(frame_files, desc="Processing frames", unit="frame"):
-        frame_path = os.path.join(frames_dir, frame_file)
-        frame = cv2.imread(frame_path)
+    try:
+        for i, frame_info in tqdm(zip(to_process, results), total=len(to_process),
+                                  desc="Processing frames", unit="frame"):
+            processed[i] = frame_info
+            if frame_info is not None and cache is not None:
+                cache.put(cache_keys[i], frame_info)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-        if frame is None:
-            print(f"Warning: Could not read {frame_file}, skipping...")
+    frames_data = []
+    for i in indices:
+        if processed[i] is None:
+            print(f"Warning: Could not read {frame_files[i]}, skipping...")
             continue
 
-        keypoints, descriptors = extract_orb_features(frame)
+        frames_data.append(processed[i])
 
-        frame_info = {
-            'filename': frame_file,
-            'path': frame_path,
-            'shape': frame.shape,
-            'num_keypoints': len(keypoints) if keypoints else 0,
-            'descriptors': descriptors
-        }
-
-        frames_data.append(frame_info)
+    if cache is not None:
+        cache.save()
+        cache.print_stats()
 
     print(f"Successfully processed {len(frames_data)} frames")
+    if frames_data:
+        warn_if_too_small(frames_data[0]['shape'], reduction)
+    count('frames_processed', len(frames_data))
     return frames_data
 
 
 def save_features(frames_data, output_file):
     print(f"Saving features to: {output_file}")
     try:
-        with open(output_file, 'wb') as f:
-            pickle.dump(frames_data, f)
+        if output_file.endswith('.pkl'):
+            with open(output_file, 'wb') as f:
+                pickle.dump(frames_data, f)
+        else:
+            save_feature_store(frames_data, output_file)
         print("Features saved successfully.")
         return True
     except Exception as e:
@@ -84,10 +208,26 @@ def print_statistics(frames_data):
     print("=" * 60)
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract ORB features from the extracted frames")
+    parser.add_argument("--workers", type=worker_count, default=1,
+                        help="Worker processes for decoding and ORB detection (0 = all cores)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse per-frame features from this content-addressed cache directory")
+    parser.add_argument("--cache-size-mb", type=float, default=1024,
+                        help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--reduction", type=int, choices=FEATURE_REDUCTIONS, default=1,
+                        help="Decode frames straight to grayscale at 1/N resolution for ORB (1 = full resolution)")
+    parser.add_argument("--global-descriptors", action="store_true",
+                        help="Also store a global descriptor per frame (needed by --method global, "
+                             "--global-candidates, --hierarchical and --dedup)")
+    return parser.parse_args()
+
+
+def main(workers=1, cache_dir=None, cache_size_mb=1024, reduction=1, global_descriptors=False):
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     frames_dir = os.path.join(project_root, "frames")
-    output_file = os.path.join(project_root, "frames_features.pkl")
+    output_file = os.path.join(project_root, "frames_features")
 
     print("=" * 60)
     print("STEP 3: ORB FEATURE EXTRACTION")
@@ -98,7 +238,12 @@ def main():
         print("Please run extract_frames.py first.")
         return
 
-    frames_data = load_and_process_frames(frames_dir)
+    cache = None
+    if cache_dir:
+        cache = FeatureCache(cache_dir, max_bytes=int(cache_size_mb * 1024 * 1024))
+
+    frames_data = load_and_process_frames(frames_dir, workers=workers, cache=cache, reduction=reduction,
+                                          global_descriptors=global_descriptors)
 
     if len(frames_data) == 0:
         print("No frames were processed. Exiting.")
@@ -117,4 +262,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(workers=args.workers, cache_dir=args.cache_dir, cache_size_mb=args.cache_size_mb, reduction=args.reduction,
+         global_descriptors=args.global_descriptors)
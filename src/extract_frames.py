@@ -1,9 +1,12 @@
 import cv2
 import os
+import argparse
 from tqdm import tqdm
+from frame_store import FRAME_BACKENDS, create_frame_writer
+from logger import count
 
 
-def extract_frames(video_path, output_dir):
+def extract_frames(video_path, output_dir, backend="jpeg", gray_scale=1.0):
 
     # Handle output directory if not present
     if not os.path.exists(output_dir):
@@ -26,33 +29,44 @@ def extract_frames(video_path, output_dir):
     print(f"  Total Frames: {total_frames}")
     print(f"  FPS: {fps}")
     print(f"  Resolution: {width}x{height}")
-    print(f"\nExtracting frames to: {output_dir}")
+    print(f"\nExtracting frames to: {output_dir} ({backend})")
     
     # Extract frames with progress bar using tqdm lib
     frame_count = 0
     success = True
+    writer = create_frame_writer(output_dir, backend=backend, gray_scale=gray_scale)
     
     with tqdm(total=total_frames, desc="Extracting frames", unit="frame") as pbar:
         while success:
             success, frame = video.read()
             
             if success:
-                # the imwrite fn saves the frame as jpg
-                frame_filename = os.path.join(output_dir, f"frame_{frame_count:05d}.jpg")
-                cv2.imwrite(frame_filename, frame)
+                # jpg files, or raw bytes appended to one memory-mappable file
+                writer.write(frame)
                 frame_count += 1
                 pbar.update(1)
     
     # release the object
     video.release()
+    writer.close()
     
     print(f"\n Successfully extracted {frame_count} frames!")
+    count('frames_decoded', frame_count)
     print(f" Frames saved in: {output_dir}")
     
     return frame_count, fps, (width, height)
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract frames from the jumbled video")
+    parser.add_argument("--backend", choices=FRAME_BACKENDS, default="jpeg",
+                        help="One JPEG per frame, or one raw memory-mapped uint8 array")
+    parser.add_argument("--gray-scale", type=float, default=1.0,
+                        help="Scale of the grayscale companion array for --backend raw (0 = none)")
+    return parser.parse_args()
+
+
+def main(backend="jpeg", gray_scale=1.0):
     """Main function to run frame extraction."""
     # Define paths
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -66,7 +80,7 @@ def main():
         return
     
     # Extract frames
-    result = extract_frames(video_path, output_dir)
+    result = extract_frames(video_path, output_dir, backend=backend, gray_scale=gray_scale)
     
     if result:
         frame_count, fps, resolution = result
@@ -77,4 +91,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(backend=args.backend, gray_scale=args.gray_scale)
@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+
+# entries whose global descriptor was computed from a colour decode in every feature mode
+GLOBAL_SOURCE = "bgr"
+
+
+class FeatureCache:
+    """On-disk per-frame descriptor cache keyed by frame content + ORB parameters.
+
+    Entries live as <key>.npy files (and, when it was requested, <key>.global.npy
+    for the frame's global descriptor) next to an index.json whose order is the
+    LRU order (least recently used first); the cache is trimmed to max_bytes
+    whenever an entry is added. index.json is only written by save(), so entry
+    files a crashed run left behind are removed when the cache is next opened.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.index = OrderedDict()
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r') as f:
+                    self.index = OrderedDict(json.load(f))
+            except Exception as e:
+                print(f"Warning: Could not read feature cache index ({e}), starting empty")
+
+        self.total_bytes = sum(entry['size'] for entry in self.index.values())
+        self.remove_orphans()
+
+    def remove_orphans(self):
+        # entries put() after the last save() have no metadata to be served with
+        removed = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.npy'):
+                continue
+            key = filename[:-len('.global.npy')] if filename.endswith('.global.npy') else filename[:-len('.npy')]
+            if key not in self.index:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            print(f"Removed {removed} feature cache files missing from the index (interrupted run)")
+
+    @staticmethod
+    def make_key(frame_source, params):
+        # frame_source is an encoded frame file, or the raw pixels themselves
+        digest = hashlib.sha1()
+        if isinstance(frame_source, str):
+            with open(frame_source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        else:
+            digest.update(np.ascontiguousarray(frame_source).data)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def global_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.global.npy")
+
+    def get(self, key, with_global=False):
+        entry = self.index.get(key)
+        # with_global, entries without a current global descriptor count as misses and get rewritten
+        has_global = entry is not None and entry.get('global_source') == GLOBAL_SOURCE \
+            and os.path.exists(self.global_path(key))
+        if entry is None or not os.path.exists(self.entry_path(key)) or (with_global and not has_global):
+            self.misses += 1
+            return None
+
+        self.index.move_to_end(key)
+        self.hits += 1
+        descriptors = np.load(self.entry_path(key))
+        return {
+            'shape': tuple(entry['shape']),
+            'num_keypoints': entry['num_keypoints'],
+            'descriptors': descriptors if entry['has_descriptors'] else None,
+            'global_descriptor': np.load(self.global_path(key)) if with_global else None
+        }
+
+    def put(self, key, frame_info):
+        descriptors = frame_info['descriptors']
+        stored = descriptors if descriptors is not None else np.zeros((0, 32), dtype=np.uint8)
+        np.save(self.entry_path(key), stored)
+        has_global = frame_info['global_descriptor'] is not None
+        if has_global:
+            np.save(self.global_path(key), frame_info['global_descriptor'])
+        elif os.path.exists(self.global_path(key)):
+            os.remove(self.global_path(key))
+
+        size = os.path.getsize(self.entry_path(key))
+        if has_global:
+            size += os.path.getsize(self.global_path(key))
+        if key in self.index:
+            self.total_bytes -= self.index[key]['size']
+        self.index[key] = {
+            'size': size,
+            'shape': list(frame_info['shape']),
+            'num_keypoints': frame_info['num_keypoints'],
+            'has_descriptors': descriptors is not None,
+            'global_source': GLOBAL_SOURCE if has_global else None
+        }
+        self.index.move_to_end(key)
+        self.total_bytes += size
+        self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            key, entry = self.index.popitem(last=False)
+            self.total_bytes -= entry['size']
+            self.evictions += 1
+            for path in (self.entry_path(key), self.global_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def save(self):
+        try:
+            # write-then-rename so a crash never leaves a half-written index behind
+            with open(self.index_file + ".tmp", 'w') as f:
+                json.dump(self.index, f)
+            os.replace(self.index_file + ".tmp", self.index_file)
+            return True
+        except Exception as e:
+            print(f"Error saving feature cache index: {e}")
+            return False
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.index),
+            'size_mb': self.total_bytes / (1024 * 1024)
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Feature cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate'] * 100:.1f}% hit rate), {stats['evictions']} evictions, "
+              f"{stats['entries']} entries / {stats['size_mb']:.2f} MB")
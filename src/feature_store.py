@@ -0,0 +1,161 @@
+import os
+import json
+import shutil
+import numpy as np
+from hamming_matcher import DESCRIPTOR_BYTES
+
+
+DESCRIPTORS_FILE = "descriptors.npy"
+OFFSETS_FILE = "offsets.npy"
+GLOBAL_FILE = "global_descriptors.npy"
+METADATA_FILE = "metadata.json"
+
+
+def save_feature_store(frames_data, store_dir):
+    """Write frames_data column-wise: every descriptor row in one flat (total, 32)
+    uint8 array, frame i owning rows offsets[i]:offsets[i + 1], plus a small
+    JSON table with filenames, paths, shapes and keypoint counts."""
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    counts = np.array([0 if f['descriptors'] is None else len(f['descriptors']) for f in frames_data],
+                      dtype=np.int64)
+    offsets = np.zeros(len(frames_data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+
+    descriptors = np.lib.format.open_memmap(os.path.join(store_dir, DESCRIPTORS_FILE), mode='w+',
+                                            dtype=np.uint8, shape=(int(offsets[-1]), DESCRIPTOR_BYTES))
+    for i, frame_info in enumerate(frames_data):
+        if counts[i] > 0:
+            descriptors[offsets[i]:offsets[i + 1]] = frame_info['descriptors']
+    descriptors.flush()
+    del descriptors
+
+    np.save(os.path.join(store_dir, OFFSETS_FILE), offsets)
+
+    global_path = os.path.join(store_dir, GLOBAL_FILE)
+    if frames_data and all(f.get('global_descriptor') is not None for f in frames_data):
+        np.save(global_path, np.stack([f['global_descriptor'] for f in frames_data]).astype(np.float32))
+    elif os.path.exists(global_path):
+        os.remove(global_path)
+
+    metadata = {
+        'filename': [f['filename'] for f in frames_data],
+        'path': [f['path'] for f in frames_data],
+        'shape': [list(f['shape']) for f in frames_data],
+        'num_keypoints': [int(f['num_keypoints']) for f in frames_data],
+        'has_descriptors': [f['descriptors'] is not None for f in frames_data]
+    }
+    with open(os.path.join(store_dir, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f)
+
+
+def frame_filenames(frames_data):
+    # a FeatureStore answers from its metadata table without building per-frame dicts
+    filenames = getattr(frames_data, 'filenames', None)
+    return filenames if filenames is not None else [f['filename'] for f in frames_data]
+
+
+def is_feature_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, METADATA_FILE))
+
+
+class FeatureStore:
+    """Read-only, list-like view of a feature store written by save_feature_store.
+
+    Only the metadata table is read up front. Descriptors are memory-mapped and
+    frame i's descriptors are a zero-copy slice of the flat array, so opening
+    the store costs the same regardless of how many frames it holds.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, METADATA_FILE), 'r') as f:
+            self.metadata = json.load(f)
+        self._descriptors = None
+        self._offsets = None
+        self._global = None
+
+    @property
+    def descriptors(self):
+        if self._descriptors is None:
+            self._descriptors = np.load(os.path.join(self.store_dir, DESCRIPTORS_FILE), mmap_mode='r')
+        return self._descriptors
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._offsets = np.load(os.path.join(self.store_dir, OFFSETS_FILE))
+        return self._offsets
+
+    @property
+    def global_descriptors(self):
+        # (n, d) float32, or None for a store written before global descriptors existed
+        path = os.path.join(self.store_dir, GLOBAL_FILE)
+        if self._global is None and os.path.exists(path):
+            self._global = np.load(path, mmap_mode='r')
+        return self._global
+
+    @property
+    def filenames(self):
+        return self.metadata['filename']
+
+    def __len__(self):
+        return len(self.metadata['filename'])
+
+    def frame_descriptors(self, i):
+        if not self.metadata['has_descriptors'][i]:
+            return None
+        return self.descriptors[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("frame index out of range")
+        return {
+            'filename': self.metadata['filename'][i],
+            'path': self.metadata['path'][i],
+            'shape': tuple(self.metadata['shape'][i]),
+            'num_keypoints': self.metadata['num_keypoints'][i],
+            'descriptors': self.frame_descriptors(i),
+            'global_descriptor': self.global_descriptors[i] if self.global_descriptors is not None else None
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        # worker processes reopen the memmaps instead of receiving a copy of the descriptors
+        return {'store_dir': self.store_dir, 'metadata': self.metadata}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _descriptors=None, _offsets=None, _global=None)
+
+
+def locate_features(project_root):
+    # the columnar store is the default; fall back to a pickle written by an older run
+    store_dir = os.path.join(project_root, "frames_features")
+    legacy_file = os.path.join(project_root, "frames_features.pkl")
+    if not os.path.exists(store_dir) and os.path.exists(legacy_file):
+        return legacy_file
+    return store_dir
+
+
+def append_feature_store(store_dir, new_frames):
+    """Add new_frames after the frames already in store_dir; they get indices
+    len(store)... The store is rewritten beside the old one and swapped in, as
+    the old descriptors are read through memory maps while it is written."""
+    store_dir = store_dir.rstrip(os.sep)
+    staging, retired = store_dir + ".new", store_dir + ".old"
+    for stale in (staging, retired):
+        if os.path.exists(stale):
+            shutil.rmtree(stale)
+
+    save_feature_store(list(FeatureStore(store_dir)) + list(new_frames), staging)
+    os.rename(store_dir, retired)
+    os.rename(staging, store_dir)
+    shutil.rmtree(retired)
@@ -0,0 +1,254 @@
+import os
+import json
+import cv2
+import numpy as np
+
+
+FRAME_BACKENDS = ("jpeg", "raw")
+
+RAW_STORE_FILE = "frame_store.json"
+RAW_FRAMES_FILE = "frames.raw"
+RAW_GRAY_FILE = "gray.raw"
+
+# libjpeg can decode straight to luma at 1/2, 1/4 or 1/8 size, never building the full BGR image
+JPEG_GRAY_MODES = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+JPEG_COLOR_MODES = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def frame_name(index, extension=".jpg"):
+    return f"frame_{index:05d}{extension}"
+
+
+def reduce_gray(frame, reduction, size=None):
+    # grayscale at 1/reduction of the frame's size (or at an explicit (width, height))
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if size is None:
+        size = (gray.shape[1] // reduction, gray.shape[0] // reduction)
+    if (gray.shape[1], gray.shape[0]) == tuple(size):
+        return gray
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+class JpegFrameStore:
+    """frames_dir/frame_%05d.jpg, one file per frame (the original layout)."""
+
+    backend = "jpeg"
+    has_gray = False
+
+    def __init__(self, frames_dir):
+        self.frames_dir = frames_dir
+        self.filenames = sorted([f for f in os.listdir(frames_dir) if f.endswith('.jpg')])
+        self._positions = {filename: i for i, filename in enumerate(self.filenames)}
+        self._small_reduction = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def index_of(self, filename):
+        return self._positions[filename]
+
+    def path(self, i):
+        return os.path.join(self.frames_dir, self.filenames[i])
+
+    def read(self, i):
+        return cv2.imread(self.path(i))
+
+    def read_gray(self, i, reduction=1):
+        return cv2.imread(self.path(i), JPEG_GRAY_MODES[reduction])
+
+    def read_small(self, i, min_size):
+        # colour at the largest JPEG reduction still at least min_size (width, height)
+        if self._small_reduction is None:
+            full = cv2.imread(self.path(i))
+            if full is None:
+                return None
+            self._small_reduction = max(r for r in JPEG_COLOR_MODES
+                                        if r == 1 or (full.shape[1] // r >= min_size[0] and
+                                                      full.shape[0] // r >= min_size[1]))
+            return full
+        return cv2.imread(self.path(i), JPEG_COLOR_MODES[self._small_reduction])
+
+    def read_by_name(self, filename):
+        return cv2.imread(os.path.join(self.frames_dir, filename))
+
+    def cache_source(self, i):
+        # the feature cache hashes the JPEG bytes on disk
+        return self.path(i)
+
+    def feature_parameters(self):
+        return {}
+
+
+class RawFrameStore:
+    """All frames in one uint8 (n, h, w, 3) memmap, plus an optional grayscale
+    (n, gh, gw) companion that feature extraction reads instead of converting.
+
+    read(i) is a zero-copy view into the memmap: nothing is decoded.
+    """
+
+    backend = "raw"
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, RAW_STORE_FILE), 'r') as f:
+            self.metadata = json.load(f)
+        self.filenames = [frame_name(i, extension="") for i in range(self.metadata['num_frames'])]
+        self._frames = None
+        self._gray = None
+
+    def __len__(self):
+        return self.metadata['num_frames']
+
+    @property
+    def has_gray(self):
+        return self.metadata['gray_scale'] is not None
+
+    @property
+    def frame_shape(self):
+        return (self.metadata['height'], self.metadata['width'], 3)
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._frames = np.memmap(os.path.join(self.store_dir, RAW_FRAMES_FILE), dtype=np.uint8, mode='r',
+                                     shape=(len(self),) + self.frame_shape)
+        return self._frames
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = np.memmap(os.path.join(self.store_dir, RAW_GRAY_FILE), dtype=np.uint8, mode='r',
+                                   shape=(len(self), self.metadata['gray_height'], self.metadata['gray_width']))
+        return self._gray
+
+    def index_of(self, filename):
+        # names carry the frame number, so this works for frame_00042 and frame_00042.jpg alike
+        return int(os.path.splitext(filename)[0].rsplit('_', 1)[-1])
+
+    def path(self, i):
+        return None
+
+    def read(self, i):
+        return self.frames[i]
+
+    def read_gray(self, i, reduction=1):
+        if reduction == 1 and self.has_gray:
+            return self.gray[i]
+        # reductions are relative to the full frame, whatever size the companion was stored at
+        frame = self.gray[i] if self.has_gray else self.frames[i]
+        return reduce_gray(frame, reduction,
+                           size=(self.metadata['width'] // reduction, self.metadata['height'] // reduction))
+
+    def read_small(self, i, min_size):
+        # the colour frames are a memmap already; callers resize the view
+        return self.frames[i]
+
+    def read_by_name(self, filename):
+        i = self.index_of(filename)
+        return self.read(i) if 0 <= i < len(self) else None
+
+    def cache_source(self, i):
+        return self.read_gray(i) if self.has_gray else self.read(i)
+
+    def feature_parameters(self):
+        return {'frame_store': 'raw', 'gray_scale': self.metadata['gray_scale']}
+
+    def __getstate__(self):
+        # worker processes reopen the memmaps
+        return {'store_dir': self.store_dir, 'metadata': self.metadata, 'filenames': self.filenames}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _frames=None, _gray=None)
+
+
+def open_frame_store(frames_dir):
+    if os.path.exists(os.path.join(frames_dir, RAW_STORE_FILE)):
+        return RawFrameStore(frames_dir)
+    return JpegFrameStore(frames_dir)
+
+
+class JpegFrameWriter:
+    def __init__(self, frames_dir):
+        self.frames_dir = frames_dir
+        self.count = 0
+
+        # a raw store in the same directory would shadow the new JPEGs
+        if os.path.exists(os.path.join(frames_dir, RAW_STORE_FILE)):
+            os.remove(os.path.join(frames_dir, RAW_STORE_FILE))
+
+    def write(self, frame):
+        cv2.imwrite(os.path.join(self.frames_dir, frame_name(self.count)), frame)
+        self.count += 1
+
+    def close(self):
+        return self.count
+
+
+class RawFrameWriter:
+    """Appends frames to frames.raw (and their grayscale companion to gray.raw);
+    the shape is only known once the last frame is in, so it is written on close."""
+
+    def __init__(self, store_dir, gray_scale=1.0):
+        self.store_dir = store_dir
+        self.gray_scale = gray_scale or None
+        self.count = 0
+        self.shape = None
+        self.gray_shape = None
+
+        # a store left over from an earlier run would otherwise describe the new files
+        if os.path.exists(os.path.join(store_dir, RAW_STORE_FILE)):
+            os.remove(os.path.join(store_dir, RAW_STORE_FILE))
+        self.frames_file = open(os.path.join(store_dir, RAW_FRAMES_FILE), 'wb')
+        self.gray_file = open(os.path.join(store_dir, RAW_GRAY_FILE), 'wb') if self.gray_scale else None
+
+    def write(self, frame):
+        if self.shape is None:
+            self.shape = frame.shape
+        elif frame.shape != self.shape:
+            raise ValueError(f"Frame {self.count} has shape {frame.shape}, expected {self.shape}")
+        self.frames_file.write(np.ascontiguousarray(frame).tobytes())
+
+        if self.gray_file is not None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.gray_scale != 1.0:
+                gray = cv2.resize(gray, None, fx=self.gray_scale, fy=self.gray_scale, interpolation=cv2.INTER_AREA)
+            self.gray_shape = gray.shape
+            self.gray_file.write(gray.tobytes())
+        self.count += 1
+
+    def close(self):
+        self.frames_file.close()
+        if self.gray_file is not None:
+            self.gray_file.close()
+
+        height, width = self.shape[:2] if self.shape is not None else (0, 0)
+        gray_height, gray_width = self.gray_shape if self.gray_shape is not None else (0, 0)
+        metadata = {
+            'num_frames': self.count,
+            'height': height,
+            'width': width,
+            'gray_scale': self.gray_scale,
+            'gray_height': gray_height,
+            'gray_width': gray_width
+        }
+        with open(os.path.join(self.store_dir, RAW_STORE_FILE), 'w') as f:
+            json.dump(metadata, f)
+        return self.count
+
+
+def create_frame_writer(frames_dir, backend="jpeg", gray_scale=1.0):
+    if backend not in FRAME_BACKENDS:
+        raise ValueError(f"Unknown frame store backend: {backend}")
+    if backend == "raw":
+        return RawFrameWriter(frames_dir, gray_scale=gray_scale)
+    return JpegFrameWriter(frames_dir)
@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+
+THUMBNAIL_SIZE = (32, 18)
+HISTOGRAM_SIZE = (160, 90)
+HSV_BINS = (8, 4, 4)
+
+# cosine similarity is mapped onto the ORB match-count scale (ORB_FEATURES), so
+# order_frames and the statistics see weights in the same range as matched keypoints
+SIMILARITY_SCALE = 500
+
+
+def unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def global_descriptor(frame):
+    """One float32 unit vector per frame: a zero-mean 32x18 grayscale thumbnail
+    (so the dot product is a brightness-invariant correlation) and, for colour
+    frames, a square-rooted HSV histogram. Grayscale frames get the thumbnail only."""
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    parts = [unit(thumbnail - thumbnail.mean())]
+
+    if frame.ndim == 3:
+        small = cv2.resize(frame, HISTOGRAM_SIZE, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        histogram = cv2.calcHist([hsv], [0, 1, 2], None, list(HSV_BINS), [0, 180, 0, 256, 0, 256]).ravel()
+        # square root: the dot product of two such histograms is their Bhattacharyya coefficient
+        parts.append(unit(np.sqrt(histogram)))
+
+    return unit(np.concatenate(parts)).astype(np.float32)
+
+
+def stack_global_descriptors(frames_data):
+    stored = getattr(frames_data, 'global_descriptors', None)
+    if stored is not None:
+        return np.asarray(stored, dtype=np.float32)
+    vectors = [f.get('global_descriptor') for f in frames_data]
+    if any(v is None for v in vectors):
+        raise ValueError("Features have no global descriptors; re-run extract_features.py --global-descriptors")
+    return np.stack(vectors).astype(np.float32)
+
+
+def global_similarity_matrix(frames_data, block_size=1024):
+    """Full n x n similarity from row blocks of X @ X.T (one BLAS GEMM each).
+
+    The vectors are unit length, so ||a - b||^2 = 2 - 2 a.b: cosine and L2
+    rank neighbours identically and one product serves both.
+    """
+    vectors = stack_global_descriptors(frames_data)
+    n = len(vectors)
+    similarity_matrix = np.zeros((n, n), dtype=np.int32)
+    print(f"\nBuilding {n}x{n} similarity matrix from {vectors.shape[1]}-d global descriptors...")
+
+    for start in tqdm(range(0, n, block_size), desc="Global similarity", unit="block"):
+        block = vectors[start:start + block_size] @ vectors.T
+        similarity_matrix[start:start + block_size] = np.rint(np.clip(block, 0.0, 1.0) * SIMILARITY_SCALE)
+    np.fill_diagonal(similarity_matrix, 0)
+    return similarity_matrix
+
+
+def global_candidate_pairs(frames_data, k=10, block_size=1024):
+    """Each frame's top-k neighbours by global descriptor; returns unique (i, j) pairs
+    with i < j, ready for ORB to re-rank (build_similarity_matrix candidates=...)."""
+    vectors = stack_global_descriptors(frames_data)
+    n = len(vectors)
+    print(f"\nGenerating candidate pairs: top-{k} of {n} frames by global descriptor...")
+    if n < 2:
+        return np.zeros((0, 2), dtype=np.int32)
+    k = min(k, n - 1)
+
+    pairs = []
+    for start in tqdm(range(0, n, block_size), desc="Retrieving neighbours", unit="block"):
+        block = vectors[start:start + block_size] @ vectors.T
+        rows = np.arange(start, start + len(block))
+        block[rows - start, rows] = -np.inf
+        neighbors = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        pairs.append(np.stack([np.repeat(rows, k), neighbors.ravel()], axis=1))
+
+    pairs = np.concatenate(pairs)
+    pairs = np.unique(np.sort(pairs, axis=1).astype(np.int32), axis=0)
+    print(f"  {len(pairs)} candidate pairs instead of {(n * (n - 1)) // 2}")
+    return pairs
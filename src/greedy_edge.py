@@ -0,0 +1,95 @@
+import numpy as np
+from sparse_similarity import KNNGraph
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return False
+        self.parent[root_b] = root_a
+        return True
+
+
+def candidate_edges(similarity, k=10):
+    if isinstance(similarity, KNNGraph):
+        return similarity.edge_list()
+    return KNNGraph.from_dense(similarity, k=k).edge_list()
+
+
+def accept_edges(pairs, weights, degree, union_find, adjacency):
+    # one vectorised sort, then the classic greedy scan: degree < 2 and no cycle
+    for idx in np.argsort(-np.asarray(weights), kind='stable'):
+        i, j = int(pairs[idx][0]), int(pairs[idx][1])
+        if i == j or degree[i] >= 2 or degree[j] >= 2:
+            continue
+        if not union_find.union(i, j):
+            continue
+        adjacency[i].append(j)
+        adjacency[j].append(i)
+        degree[i] += 1
+        degree[j] += 1
+
+
+def path_fragments(n, degree, adjacency):
+    seen = [False] * n
+    fragments = []
+    for start in range(n):
+        if seen[start] or degree[start] == 2:
+            continue
+        fragment = [start]
+        seen[start] = True
+        previous, current = -1, start
+        while True:
+            step = [x for x in adjacency[current] if x != previous]
+            if not step:
+                break
+            previous, current = current, step[0]
+            fragment.append(current)
+            seen[current] = True
+        fragments.append(fragment)
+    return fragments
+
+
+def greedy_edge_path(similarity, k=10, max_endpoints=4000, fixed_edges=()):
+    """Greedy-edge Hamiltonian path: accept edges best first unless a frame would get
+    degree 3 or a cycle would close, then join the remaining fragments end to end."""
+    n = len(similarity)
+    if n < 2:
+        return list(range(n))
+
+    degree = [0] * n
+    union_find = UnionFind(n)
+    adjacency = [[] for _ in range(n)]
+
+    for i, j in fixed_edges:
+        accept_edges([(i, j)], [1], degree, union_find, adjacency)
+
+    pairs, weights = candidate_edges(similarity, k=k)
+    accept_edges(pairs, weights, degree, union_find, adjacency)
+
+    # fragments left over: retry between fragment endpoints with the full similarity
+    endpoints = [i for i in range(n) if degree[i] < 2]
+    if len(endpoints) > 2 and not isinstance(similarity, KNNGraph) and len(endpoints) <= max_endpoints:
+        ends = np.array(endpoints)
+        if hasattr(similarity, 'submatrix'):
+            sub = similarity.submatrix(ends)
+        else:
+            sub = np.asarray(similarity)[np.ix_(ends, ends)]
+        a, b = np.triu_indices(len(ends), k=1)
+        accept_edges(np.stack([ends[a], ends[b]], axis=1), sub[a, b], degree, union_find, adjacency)
+
+    path = []
+    for fragment in path_fragments(n, degree, adjacency):
+        path.extend(fragment)
+    return path
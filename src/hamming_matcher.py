@@ -0,0 +1,89 @@
+import numpy as np
+from tqdm import tqdm
+
+
+DESCRIPTOR_BYTES = 32
+DESCRIPTOR_BITS = DESCRIPTOR_BYTES * 8
+
+# anything below every real +/-1 dot product (which lies in [-256, 256])
+INVALID_SCORE = np.float32(-1e9)
+
+
+def pack_descriptors(frames_data):
+    n = len(frames_data)
+    counts = np.array(
+        [0 if f['descriptors'] is None else len(f['descriptors']) for f in frames_data],
+        dtype=np.int32
+    )
+    max_kp = int(counts.max()) if n > 0 else 0
+    packed = np.zeros((n, max_kp, DESCRIPTOR_BYTES), dtype=np.uint8)
+
+    for i, frame_info in enumerate(frames_data):
+        if counts[i] > 0:
+            packed[i, :counts[i]] = frame_info['descriptors']
+
+    return packed, counts
+
+
+def signed_bits(packed):
+    # Hamming trick: with bits mapped to +1/-1, dot(a, b) = 256 - 2 * hamming(a, b),
+    # so the nearest descriptor is the one with the largest dot product and a
+    # whole block of distances becomes a single float32 GEMM (exact for |x| <= 256)
+    bits = np.unpackbits(packed, axis=-1).astype(np.float32)
+    return 1.0 - 2.0 * bits
+
+
+def cross_check_counts(query_bits, query_count, train_bits, train_counts):
+    """Cross-checked match counts of one query frame against a block of frames.
+
+    Reproduces cv2.BFMatcher(NORM_HAMMING, crossCheck=True): a match is a
+    mutual nearest neighbour pair, ties resolved towards the lower index.
+    """
+    num_train, max_kp = train_bits.shape[0], train_bits.shape[1]
+    result = np.zeros(num_train, dtype=np.int32)
+    if query_count == 0 or num_train == 0:
+        return result
+
+    query = query_bits[:query_count]
+    scores = query @ train_bits.reshape(-1, DESCRIPTOR_BITS).T
+    scores = scores.reshape(query_count, num_train, max_kp).transpose(1, 0, 2)
+
+    train_valid = np.arange(max_kp)[None, :] < train_counts[:, None]
+    scores[~np.broadcast_to(train_valid[:, None, :], scores.shape)] = INVALID_SCORE
+
+    best_train = scores.argmax(axis=2)
+    best_query = scores.argmax(axis=1)
+
+    back = np.take_along_axis(best_query, best_train, axis=1)
+    mutual = back == np.arange(query_count)[None, :]
+    result[:] = mutual.sum(axis=1)
+    result[train_counts == 0] = 0
+    return result
+
+
+def match_block(packed, counts, row, cols):
+    return cross_check_counts(signed_bits(packed[row]), int(counts[row]),
+                              signed_bits(packed[cols]), counts[cols])
+
+
+def build_similarity_matrix_batched(frames_data, block_size=32):
+    n = len(frames_data)
+    similarity_matrix = np.zeros((n, n), dtype=np.int32)
+
+    print(f"\nBuilding {n}x{n} similarity matrix...")
+    print(f"Comparing frame pairs in blocks of {block_size} using batched Hamming distances...")
+
+    packed, counts = pack_descriptors(frames_data)
+
+    total_comparisons = (n * (n - 1)) // 2
+
+    with tqdm(total=total_comparisons, desc="Computing similarities", unit="pair") as pbar:
+        for i in range(n):
+            for start in range(i + 1, n, block_size):
+                cols = np.arange(start, min(start + block_size, n))
+                matches = match_block(packed, counts, i, cols)
+                similarity_matrix[i, cols] = matches
+                similarity_matrix[cols, i] = matches
+                pbar.update(len(cols))
+
+    return similarity_matrix
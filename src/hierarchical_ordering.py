@@ -0,0 +1,210 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+from tqdm import tqdm
+from global_descriptors import SIMILARITY_SCALE, stack_global_descriptors
+from hamming_matcher import pack_descriptors, match_block
+from sparse_similarity import KNNGraph
+from greedy_edge import greedy_edge_path
+from local_search import optimize_path
+from profiler import start_worker_profile
+from logger import count
+
+
+_worker_state = {}
+
+
+def spherical_kmeans(vectors, k, iterations=10, seed=0, block_size=4096):
+    # unit vectors: assign by largest dot product, centroids are renormalised means
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+    labels = np.zeros(n, dtype=np.int64)
+
+    for _ in range(iterations):
+        for start in range(0, n, block_size):
+            labels[start:start + block_size] = (vectors[start:start + block_size] @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        sizes = np.bincount(labels, minlength=k)
+        empty = sizes == 0
+        # reseed empty clusters on random frames so k stays k
+        sums[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return labels
+
+
+def cluster_frames(vectors, max_cluster_size=500, branching=16, seed=0):
+    """Split frames into segments of at most max_cluster_size by recursive
+    spherical k-means on their global descriptors (O(n log n) dot products).
+
+    Frames of one shot look alike, so they land together; a long shot is cut
+    into several segments, which the stitching step joins again.
+    """
+    target = max(max_cluster_size // 2, 1)
+    clusters = []
+    pending = [np.arange(len(vectors))]
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= max_cluster_size:
+            clusters.append(indices)
+            continue
+        k = int(min(branching, np.ceil(len(indices) / target)))
+        labels = spherical_kmeans(vectors[indices], k, seed=seed + len(clusters))
+        parts = [indices[labels == label] for label in range(k) if np.any(labels == label)]
+        if len(parts) == 1:
+            # identical signatures cannot be separated; fall back to fixed-size chunks
+            parts = np.array_split(indices, int(np.ceil(len(indices) / target)))
+        pending.extend(parts)
+    return clusters
+
+
+def cluster_similarity(frames, method, block_size=32):
+    # dense similarity of one cluster; quiet, since many clusters are ordered at once
+    m = len(frames)
+    if method == "global":
+        vectors = stack_global_descriptors(frames)
+        matrix = np.rint(np.clip(vectors @ vectors.T, 0.0, 1.0) * SIMILARITY_SCALE).astype(np.int32)
+        np.fill_diagonal(matrix, 0)
+        return matrix
+
+    matrix = np.zeros((m, m), dtype=np.int32)
+    if method == "batched":
+        packed, counts = pack_descriptors(frames)
+        for i in range(m):
+            for start in range(i + 1, m, block_size):
+                cols = np.arange(start, min(start + block_size, m))
+                matrix[i, cols] = match_block(packed, counts, i, cols)
+    else:
+        from build_similarity_matrix import compare_frames
+        for i in range(m):
+            for j in range(i + 1, m):
+                matrix[i, j] = compare_frames(frames[i]['descriptors'], frames[j]['descriptors'])
+    return matrix + matrix.T
+
+
+def order_cluster(frames_data, indices, method, neighbors_k=10):
+    """Order one cluster on its own dense similarity: greedy edge, then local search.
+    Returns the cluster's frames in order and the consecutive similarities."""
+    if len(indices) == 1:
+        return [int(indices[0])], np.zeros(0, dtype=np.int64)
+    matrix = cluster_similarity([frames_data[int(i)] for i in indices], method)
+    path = greedy_edge_path(matrix, k=neighbors_k)
+    path, _ = optimize_path(path, matrix, neighbors_k=neighbors_k)
+    weights = matrix[path[:-1], path[1:]].astype(np.int64)
+    return [int(indices[p]) for p in path], weights
+
+
+def _init_worker(frames_data, method):
+    start_worker_profile()
+    _worker_state['frames_data'] = frames_data
+    _worker_state['method'] = method
+
+
+def _order_cluster_worker(task):
+    cluster_id, indices = task
+    path, weights = order_cluster(_worker_state['frames_data'], indices, _worker_state['method'])
+    return cluster_id, path, weights
+
+
+def endpoint_similarity(frames_data, endpoints, vectors, method, k=10):
+    """Similarity between cluster endpoints: the global descriptors shortlist each
+    endpoint's top-k, and with an ORB method those pairs are re-scored by matching."""
+    m = len(endpoints)
+    scores = vectors[endpoints] @ vectors[endpoints].T
+    owner = np.arange(m) // 2
+    # a cluster's own two ends are joined by the cluster itself
+    scores[owner[:, None] == owner[None, :]] = -np.inf
+    matrix = np.zeros((m, m), dtype=np.int32)
+    if m < 4:
+        return matrix
+
+    k = min(k, m - 2)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    pairs = np.unique(np.sort(np.stack([np.repeat(np.arange(m), k), top.ravel()], axis=1), axis=1), axis=0)
+    if method == "global":
+        values = np.rint(np.clip(scores[pairs[:, 0], pairs[:, 1]], 0.0, 1.0) * SIMILARITY_SCALE)
+    else:
+        from build_similarity_matrix import match_pairs
+        values = match_pairs(frames_data, endpoints[pairs], method=method)
+    matrix[pairs[:, 0], pairs[:, 1]] = values
+    matrix[pairs[:, 1], pairs[:, 0]] = values
+    return matrix
+
+
+def stitch_clusters(paths, endpoint_matrix):
+    """Order and orient the clusters. Endpoint 2c is the first frame of cluster c
+    and 2c + 1 its last; with the edge between them fixed, a greedy-edge path over
+    endpoints visits every cluster end to end, in one direction or the other."""
+    fixed = [(2 * c, 2 * c + 1) for c in range(len(paths))]
+    endpoint_path = greedy_edge_path(endpoint_matrix, k=10, fixed_edges=fixed)
+
+    order = []
+    seams = []
+    for position in range(0, len(endpoint_path), 2):
+        entry, leave = endpoint_path[position], endpoint_path[position + 1]
+        cluster = entry // 2
+        order.append((cluster, entry > leave))
+        if position + 2 < len(endpoint_path):
+            seams.append(int(endpoint_matrix[leave, endpoint_path[position + 2]]))
+    return order, seams
+
+
+def order_frames_hierarchical(frames_data, method="batched", max_cluster_size=500, workers=1):
+    """Cluster, order every cluster independently, then stitch the clusters.
+
+    Each cluster gets a dense max_cluster_size^2 matrix at most, so memory is
+    bounded by the largest cluster and total matching work grows linearly with
+    the number of frames. Returns (path, score, graph); graph holds the path's
+    consecutive similarities for the statistics.
+    """
+    n = len(frames_data)
+    vectors = stack_global_descriptors(frames_data)
+
+    print(f"\nClustering {n} frames into segments of at most {max_cluster_size} (global descriptors)...")
+    clusters = cluster_frames(vectors, max_cluster_size=max_cluster_size)
+    sizes = [len(c) for c in clusters]
+    print(f"  {len(clusters)} clusters, sizes {min(sizes)}-{max(sizes)} (mean {np.mean(sizes):.0f})")
+
+    tasks = list(enumerate(clusters))
+    paths = [None] * len(clusters)
+    weights = [None] * len(clusters)
+    if workers != 1 and len(clusters) > 1:
+        workers = workers or os.cpu_count() or 1
+        print(f"Ordering clusters with {workers} worker processes ({method})")
+        with Pool(processes=workers, initializer=_init_worker, initargs=(frames_data, method)) as pool:
+            # largest first, so one big cluster does not finish last on its own
+            tasks.sort(key=lambda task: -len(task[1]))
+            for cluster_id, path, cluster_weights in tqdm(pool.imap_unordered(_order_cluster_worker, tasks),
+                                                          total=len(tasks), desc="Ordering clusters",
+                                                          unit="cluster"):
+                paths[cluster_id], weights[cluster_id] = path, cluster_weights
+            pool.close()
+            pool.join()
+    else:
+        for cluster_id, indices in tqdm(tasks, desc="Ordering clusters", unit="cluster"):
+            paths[cluster_id], weights[cluster_id] = order_cluster(frames_data, indices, method)
+    count('pairs_matched', sum(s * (s - 1) // 2 for s in sizes))
+
+    print(f"\nStitching {len(clusters)} clusters by the similarity of their endpoint frames...")
+    endpoints = np.array([end for path in paths for end in (path[0], path[-1])], dtype=np.int64)
+    endpoint_matrix = endpoint_similarity(frames_data, endpoints, vectors, method)
+    cluster_order, seams = stitch_clusters(paths, endpoint_matrix)
+
+    path = []
+    consecutive = []
+    for position, (cluster, reverse) in enumerate(cluster_order):
+        if position > 0:
+            consecutive.append(seams[position - 1])
+        cluster_path = paths[cluster][::-1] if reverse else paths[cluster]
+        cluster_weights = weights[cluster][::-1] if reverse else weights[cluster]
+        path.extend(cluster_path)
+        consecutive.extend(cluster_weights.tolist())
+
+    score = int(sum(consecutive))
+    pairs = np.stack([path[:-1], path[1:]], axis=1) if n > 1 else np.zeros((0, 2), dtype=np.int64)
+    graph = KNNGraph.from_pairs(n, pairs, consecutive, k=2)
+    print(f"  Hierarchical path: score = {score}, {len(seams)} seams (mean seam similarity "
+          f"{np.mean(seams) if seams else 0:.1f})")
+    return path, score, graph
@@ -0,0 +1,288 @@
+import os
+import argparse
+import numpy as np
+from build_similarity_matrix import SIMILARITY_METHODS, load_features, match_pairs, save_similarity_matrix
+from extract_features import FEATURE_REDUCTIONS, load_and_process_frames, save_features
+from feature_store import append_feature_store, is_feature_store, locate_features
+from frame_store import open_frame_store
+from global_descriptors import SIMILARITY_SCALE, stack_global_descriptors
+from order_frames import load_similarity_matrix, load_approximate_order, save_frame_order, print_order_statistics
+from packed_similarity import PACKED_DTYPE, PackedSimilarity
+from sparse_similarity import KNNGraph
+from local_search import optimize_path, edge_weight_function
+from logger import count, span
+from parallel_similarity import worker_count
+
+
+class RowNeighborLists:
+    """Best-first top-k neighbours of a dense or packed matrix, computed only for
+    the frames local search visits instead of for all n rows up front."""
+
+    def __init__(self, similarity, k=10):
+        self.similarity = similarity
+        self.k = k
+        self.lists = {}
+
+    def __getitem__(self, i):
+        if i not in self.lists:
+            row = np.array(self.similarity[i], dtype=np.int64)
+            row[i] = -1
+            k = min(self.k, len(row) - 1)
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind='stable')]
+            self.lists[i] = [int(j) for j in top if row[j] > 0]
+        return self.lists[i]
+
+
+def find_new_frames(frames_dir, frames_data):
+    # frames on disk that the feature store has not seen yet, in frame order
+    known = set(frames_data.filenames if hasattr(frames_data, 'filenames') else (f['filename'] for f in frames_data))
+    return [name for name in open_frame_store(frames_dir).filenames if name not in known]
+
+
+def new_frame_pairs(frames_data, n_old, global_candidates=0, block_size=1024):
+    """Pairs (i, j), i < j, involving at least one new frame (index >= n_old):
+    each new frame against every other frame, or only against its
+    global_candidates nearest frames by global descriptor."""
+    n = len(frames_data)
+    new = np.arange(n_old, n)
+    if global_candidates <= 0:
+        old_pairs = np.stack(np.meshgrid(np.arange(n_old), new, indexing='ij'), axis=-1).reshape(-1, 2)
+        i, j = np.triu_indices(len(new), k=1)
+        return np.concatenate([old_pairs, np.stack([new[i], new[j]], axis=1)])
+
+    vectors = stack_global_descriptors(frames_data)
+    k = min(global_candidates, n - 1)
+    pairs = []
+    for start in range(0, len(new), block_size):
+        rows = new[start:start + block_size]
+        scores = vectors[rows] @ vectors.T
+        scores[np.arange(len(rows)), rows] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        pairs.append(np.stack([np.repeat(rows, k), top.ravel()], axis=1))
+    return np.unique(np.sort(np.concatenate(pairs), axis=1), axis=0)
+
+
+def score_pairs(frames_data, pairs, method):
+    if method == "global":
+        vectors = stack_global_descriptors(frames_data)
+        count('pairs_matched', len(pairs))
+        cosine = np.einsum('ij,ij->i', vectors[pairs[:, 0]], vectors[pairs[:, 1]])
+        return np.rint(np.clip(cosine, 0.0, 1.0) * SIMILARITY_SCALE).astype(np.int32)
+    return match_pairs(frames_data, pairs, method=method)
+
+
+def grow_similarity(similarity, n, pairs, values):
+    """The stored similarity enlarged to n frames, with the new pairs filled in.
+    Old pairs are copied, never re-matched."""
+    if isinstance(similarity, KNNGraph):
+        # new frames can displace an old frame's weakest listed neighbour
+        old_pairs, old_values = similarity.edge_list()
+        return KNNGraph.from_pairs(n, np.concatenate([old_pairs, pairs]), np.concatenate([old_values, values]),
+                                   k=similarity.k)
+
+    old_n = len(similarity)
+    if isinstance(similarity, PackedSimilarity):
+        grown = PackedSimilarity(n, np.zeros(n * (n - 1) // 2, dtype=PACKED_DTYPE))
+        for i in range(old_n - 1):
+            # row i's old pairs (i, i+1..old_n-1) lead its longer new row
+            old_start, start = similarity.row_offsets[i], grown.row_offsets[i]
+            grown.values[start:start + old_n - i - 1] = similarity.values[old_start:old_start + old_n - i - 1]
+        grown.values[grown.index(pairs[:, 0], pairs[:, 1])] = np.clip(values, 0, np.iinfo(PACKED_DTYPE).max)
+        return grown
+
+    grown = np.zeros((n, n), dtype=np.int32)
+    grown[:old_n, :old_n] = similarity
+    grown[pairs[:, 0], pairs[:, 1]] = values
+    grown[pairs[:, 1], pairs[:, 0]] = values
+    return grown
+
+
+def insertion_candidates(pairs, values, n_old, k=10):
+    # each new frame's k best matched frames, best first
+    candidates = {}
+    for (i, j), value in zip(pairs.tolist(), values.tolist()):
+        if value <= 0:
+            continue
+        for x, other in ((i, j), (j, i)):
+            if x >= n_old:
+                candidates.setdefault(x, []).append((value, other))
+    return {x: [other for _, other in sorted(matches, reverse=True)[:k]] for x, matches in candidates.items()}
+
+
+def cheapest_insertion(path, new_frames, weight, candidates, n):
+    """Insert every new frame x where it adds the most similarity: between
+    consecutive frames a, b (gain w(a, x) + w(x, b) - w(a, b)) or at either end.
+    Only the slots beside x's matched candidates are scored, so an insertion
+    costs O(k) whatever the length of the path.
+
+    Returns the new path and the frames whose path neighbours changed.
+    """
+    next_frame = np.full(n, -1, dtype=np.int64)
+    prev_frame = np.full(n, -1, dtype=np.int64)
+    placed = np.zeros(n, dtype=bool)
+    for a, b in zip(path[:-1], path[1:]):
+        next_frame[a], prev_frame[b] = b, a
+    placed[path] = True
+    head, tail = path[0], path[-1]
+
+    def gain(a, x, b):
+        joined = (weight(a, x) if a >= 0 else 0) + (weight(x, b) if b >= 0 else 0)
+        return joined - (weight(a, b) if a >= 0 and b >= 0 else 0)
+
+    # confident frames first: the later ones can then attach to them
+    best_match = {x: weight(x, candidates[x][0]) if candidates.get(x) else 0 for x in new_frames}
+    touched = set()
+    for x in sorted(new_frames, key=lambda frame: -best_match[frame]):
+        # unmatched frames go to the end, where they break nothing
+        best_gain, (a, b) = gain(tail, x, -1), (tail, -1)
+        for c in candidates.get(x, []):
+            if not placed[c]:
+                continue
+            for slot in ((prev_frame[c], c), (c, next_frame[c])):
+                slot_gain = gain(slot[0], x, slot[1])
+                if slot_gain > best_gain:
+                    best_gain, (a, b) = slot_gain, slot
+
+        prev_frame[x], next_frame[x] = a, b
+        if a >= 0:
+            next_frame[a] = x
+        else:
+            head = x
+        if b >= 0:
+            prev_frame[b] = x
+        else:
+            tail = x
+        placed[x] = True
+        touched.update(int(f) for f in (a, x, b) if f >= 0)
+
+    new_path = []
+    frame = head
+    while frame >= 0:
+        new_path.append(int(frame))
+        frame = next_frame[frame]
+    return new_path, sorted(touched)
+
+
+def insert_new_frames(order, frames_data, similarity, n_old, method="bruteforce", global_candidates=0,
+                      neighbors_k=10):
+    """Match the frames from index n_old on against the rest, grow the similarity
+    with them and insert them into order. Work is O(m * n) matches for m new
+    frames (O(m * global_candidates) with a shortlist) and local search starts
+    only from the frames around the insertions.
+
+    Returns (path, score, grown similarity).
+    """
+    n = len(frames_data)
+    print(f"\nInserting {n - n_old} new frames into the order of {n_old} frames...")
+
+    with span('incremental_matching'):
+        pairs = new_frame_pairs(frames_data, n_old, global_candidates=global_candidates)
+        print(f"  Matching {len(pairs)} pairs with a new frame ({method}) instead of {(n * (n - 1)) // 2}")
+        values = score_pairs(frames_data, pairs, method)
+        similarity = grow_similarity(similarity, n, pairs, values)
+
+    with span('incremental_insertion'):
+        weight = edge_weight_function(similarity)
+        candidates = insertion_candidates(pairs, values, n_old, k=neighbors_k)
+        path, touched = cheapest_insertion(list(order), list(range(n_old, n)), weight, candidates, n)
+        inserted_score = sum(weight(path[p], path[p + 1]) for p in range(n - 1))
+
+        neighbor_lists = similarity.neighbor_lists() if isinstance(similarity, KNNGraph) \
+            else RowNeighborLists(similarity, k=neighbors_k)
+        path, moves = optimize_path(path, similarity, neighbor_lists=neighbor_lists, active=touched)
+        score = int(sum(weight(path[p], path[p + 1]) for p in range(n - 1)))
+
+    print(f"  Cheapest insertion: score = {inserted_score}")
+    print(f"  Local search from {len(touched)} affected frames: {moves} improving moves, score = {score}")
+    return path, score, similarity
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Insert frames added to frames/ into an existing frame order "
+                                                 "without rebuilding the similarity matrix")
+    parser.add_argument("--method", choices=SIMILARITY_METHODS, default="bruteforce",
+                        help="Similarity for the new pairs; use the one the stored matrix was built with")
+    parser.add_argument("--similarity", default="similarity_matrix.npy",
+                        help="Dense similarity_matrix.npy, packed similarity_matrix.npz or sparse "
+                             "similarity_graph.npz to grow (relative to the project root)")
+    parser.add_argument("--global-candidates", type=int, default=0,
+                        help="Match each new frame only against its top-K frames by global descriptor "
+                             "(0 = against every frame)")
+    parser.add_argument("--workers", type=worker_count, default=1,
+                        help="Worker processes for the new frames' feature extraction (0 = all cores)")
+    parser.add_argument("--reduction", type=int, choices=FEATURE_REDUCTIONS, default=1,
+                        help="Feature decode reduction; must match the one the existing features used")
+    return parser.parse_args()
+
+
+def main(method="bruteforce", similarity_file="similarity_matrix.npy", global_candidates=0, workers=1, reduction=1):
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    frames_dir = os.path.join(project_root, "frames")
+    features_file = locate_features(project_root)
+    matrix_file = os.path.join(project_root, similarity_file)
+    order_file = os.path.join(project_root, "frame_order.pkl")
+
+    print("=" * 60)
+    print("INSERT NEW FRAMES INTO THE FRAME ORDER")
+    print("=" * 60)
+
+    for path, step in ((frames_dir, "extract_frames.py"), (features_file, "extract_features.py"),
+                       (matrix_file, "build_similarity_matrix.py"), (order_file, "order_frames.py")):
+        if not os.path.exists(path):
+            print(f"Error: {path} not found")
+            print(f"Please run {step} first.")
+            return
+
+    frames_data = load_features(features_file)
+    similarity = load_similarity_matrix(matrix_file)
+    order = load_approximate_order(order_file)
+    if frames_data is None or similarity is None:
+        print("Failed to load required data. Exiting.")
+        return
+
+    n_old = len(frames_data)
+    if len(similarity) != n_old or len(order) != n_old:
+        print(f"Error: {n_old} frames have features but the similarity covers {len(similarity)} and the "
+              f"order {len(order)}; rebuild them before inserting frames")
+        return
+
+    new_names = find_new_frames(frames_dir, frames_data)
+    if not new_names:
+        print("No new frames found; the order is up to date.")
+        return
+
+    # new frames need global descriptors to use them, or to keep the saved features' column complete
+    with_global = method == "global" or global_candidates > 0 or (n_old > 0 and frames_data[0]['global_descriptor'] is not None)
+    new_frames = load_and_process_frames(frames_dir, workers=workers, reduction=reduction, filenames=new_names,
+                                         global_descriptors=with_global)
+    if not new_frames:
+        print("No new frames could be processed. Exiting.")
+        return
+
+    # descriptors of the old frames stay memory-mapped; nothing is written until the order is done
+    all_frames = list(frames_data) + new_frames
+    path, score, similarity = insert_new_frames(order, all_frames, similarity, n_old, method=method,
+                                                global_candidates=global_candidates)
+    print_order_statistics(path, all_frames, similarity)
+
+    if is_feature_store(features_file):
+        print(f"Appending {len(new_frames)} frames to: {features_file}")
+        append_feature_store(features_file, new_frames)
+    else:
+        save_features(all_frames, features_file)
+    saved = save_similarity_matrix(similarity, matrix_file)
+    saved = save_frame_order(path, all_frames, order_file) and saved
+
+    if saved:
+        print("\nIncremental update complete.")
+        print(f"{len(new_frames)} frames inserted; {len(path)} frames ordered, total path score: {score}")
+        print("\nNext Step: Reconstruct the video using the updated frame order.")
+    else:
+        print("\nFailed to save the updated similarity or frame order.")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(method=args.method, similarity_file=args.similarity, global_candidates=args.global_candidates,
+         workers=args.workers, reduction=args.reduction)
@@ -0,0 +1,165 @@
+import time
+import numpy as np
+from collections import deque
+from sparse_similarity import KNNGraph
+
+
+def edge_weight_function(similarity):
+    if hasattr(similarity, 'weight'):
+        return similarity.weight
+    return np.asarray(similarity).item
+
+
+def build_neighbor_lists(similarity, k=10):
+    if isinstance(similarity, KNNGraph):
+        return similarity.neighbor_lists()
+    return KNNGraph.from_dense(similarity, k=k).neighbor_lists()
+
+
+class PathLocalSearch:
+    """2-opt and Or-opt local search on an open path, maximising total edge similarity.
+
+    Every move is scored from the few edges it removes and adds, candidate
+    moves only join a frame to one of its listed neighbours, and don't-look
+    bits (a queue of active frames) skip frames whose surroundings have not
+    changed since they last failed to improve.
+    """
+
+    def __init__(self, path, weight, neighbor_lists, max_segment=3):
+        self.path = list(path)
+        self.n = len(self.path)
+        self.weight = weight
+        self.neighbor_lists = neighbor_lists
+        self.max_segment = max_segment
+        self.position = [0] * self.n
+        for idx, frame in enumerate(self.path):
+            self.position[frame] = idx
+
+    def edge(self, i, j):
+        # similarity between path positions i and j; positions off either end do not exist
+        if i < 0 or j < 0 or i >= self.n or j >= self.n:
+            return 0
+        return self.weight(self.path[i], self.path[j])
+
+    def reversal_gain(self, i, j):
+        # reverse path[i..j]: edges (i-1, i) and (j, j+1) become (i-1, j) and (i, j+1)
+        return (self.edge(i - 1, j) + self.edge(i, j + 1)
+                - self.edge(i - 1, i) - self.edge(j, j + 1))
+
+    def apply_reversal(self, i, j):
+        path, position = self.path, self.position
+        path[i:j + 1] = path[i:j + 1][::-1]
+        for idx in range(i, j + 1):
+            position[path[idx]] = idx
+        return [path[k] for k in (i - 1, i, j, j + 1) if 0 <= k < self.n]
+
+    def relocation_gain(self, s, e, x, y, a_first):
+        # move path[s..e] between positions x and y (adjacent, outside the segment);
+        # a_first puts path[s] next to x, otherwise the segment is reversed
+        head, tail = (s, e) if a_first else (e, s)
+        removed = self.edge(s - 1, s) + self.edge(e, e + 1)
+        bridged = self.edge(s - 1, e + 1) if s > 0 and e < self.n - 1 else 0
+        inserted = self.edge(x, head) + self.edge(tail, y) - self.edge(x, y)
+        return bridged - removed + inserted
+
+    def apply_relocation(self, s, e, x, y, a_first):
+        path = self.path
+        touched = [path[k] for k in (s - 1, s, e, e + 1, x, y) if 0 <= k < self.n]
+        segment = path[s:e + 1] if a_first else path[s:e + 1][::-1]
+        del path[s:e + 1]
+
+        # x is an original position outside the segment; -1 means "insert at the front"
+        insert_at = (x if x < s else x - len(segment)) + 1
+        path[insert_at:insert_at] = segment
+
+        lo, hi = min(s, insert_at), max(e, insert_at + len(segment) - 1)
+        for idx in range(lo, hi + 1):
+            self.position[path[idx]] = idx
+        return touched
+
+    def candidate_moves(self, a, c):
+        i, j = self.position[a], self.position[c]
+
+        # 2-opt: the two reversals that make a and c adjacent (c lands right after a, or a right before c)
+        if i < j:
+            reversals = [(i + 1, j), (i, j - 1)]
+        else:
+            reversals = [(j + 1, i), (j, i - 1)]
+        for lo, hi in reversals:
+            if lo < hi:
+                yield ('reverse', lo, hi)
+
+        # Or-opt: relocate a segment of up to max_segment frames ending at a next to c
+        for length in range(1, self.max_segment + 1):
+            for s, e in ((i, i + length - 1), (i - length + 1, i)):
+                if s < 0 or e >= self.n or s <= j <= e:
+                    continue
+                a_at_start = (s == i)
+                # insert right after c (c, a, ...) or right before it (..., a, c)
+                for x, y, a_first in ((j, j + 1, a_at_start), (j - 1, j, not a_at_start)):
+                    if not (s <= x <= e or s <= y <= e):
+                        yield ('relocate', s, e, x, y, a_first)
+                if length == 1:
+                    break
+
+    def move_gain(self, move):
+        if move[0] == 'reverse':
+            return self.reversal_gain(move[1], move[2])
+        return self.relocation_gain(*move[1:])
+
+    def apply_move(self, move):
+        if move[0] == 'reverse':
+            return self.apply_reversal(move[1], move[2])
+        return self.apply_relocation(*move[1:])
+
+    def improve_frame(self, a):
+        i = self.position[a]
+        current = min(self.edge(i - 1, i) if i > 0 else 0, self.edge(i, i + 1) if i < self.n - 1 else 0)
+
+        for c in self.neighbor_lists[a]:
+            # lists are best first: once the new edge cannot beat a's weaker edge, stop
+            if self.weight(a, c) <= current:
+                break
+            for move in self.candidate_moves(a, c):
+                if self.move_gain(move) > 0:
+                    return self.apply_move(move)
+        return None
+
+    def run(self, active=None, max_moves=None, deadline=None):
+        queue = deque(self.path if active is None else active)
+        queued = [False] * self.n
+        for frame in queue:
+            queued[frame] = True
+
+        moves = 0
+        visits = 0
+        while queue:
+            if max_moves is not None and moves >= max_moves:
+                break
+            visits += 1
+            if deadline is not None and visits % 256 == 0 and time.time() > deadline:
+                break
+
+            a = queue.popleft()
+            queued[a] = False
+            touched = self.improve_frame(a)
+            if touched is None:
+                continue
+
+            moves += 1
+            for frame in touched + [a]:
+                if not queued[frame]:
+                    queued[frame] = True
+                    queue.append(frame)
+
+        return self.path, moves
+
+
+def optimize_path(path, similarity, neighbors_k=10, neighbor_lists=None, active=None,
+                  max_moves=None, deadline=None, max_segment=3):
+    if len(path) < 3:
+        return list(path), 0
+    if neighbor_lists is None:
+        neighbor_lists = build_neighbor_lists(similarity, k=neighbors_k)
+    search = PathLocalSearch(path, edge_weight_function(similarity), neighbor_lists, max_segment=max_segment)
+    return search.run(active=active, max_moves=max_moves, deadline=deadline)
@@ -1,20 +1,179 @@
 import time
 import os
+import sys
+import json
+import resource
+from contextlib import contextmanager
 from datetime import datetime
 
 
+_active_logger = None
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux and bytes on macOS; pool workers show up under RUSAGE_CHILDREN
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / scale
+
+
+def reset_phase_peak_rss():
+    # Linux: writing 5 to clear_refs resets this process's VmHWM to its current RSS
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def phase_peak_rss_mb():
+    """This process's VmHWM (peak RSS since the last reset_phase_peak_rss), or None
+    where /proc is unavailable. Unlike peak_rss_mb it excludes worker processes."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def cpu_seconds():
+    # this process plus any child processes that have been waited for
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def count(name, value=1):
+    """Add to a counter of the innermost open phase or span; a no-op without a logger."""
+    if _active_logger is not None:
+        _active_logger.count(name, value)
+
+
+def span(name):
+    if _active_logger is not None:
+        return _active_logger.span(name)
+    return _null_span()
+
+
+@contextmanager
+def _null_span():
+    yield
+
+
+def merge_span(spans, name, calls, wall_seconds, cpu_seconds, counters):
+    total = spans.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'counters': {}})
+    total['calls'] += calls
+    total['wall_seconds'] = round(total['wall_seconds'] + wall_seconds, 4)
+    total['cpu_seconds'] = round(total['cpu_seconds'] + cpu_seconds, 4)
+    for key, value in counters.items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+
+
 class ExecutionLogger:
-    def __init__(self, log_file="execution_log.txt"):
+    """Human-readable phase log plus structured metrics.
+
+    Every phase and span measures wall time, CPU time (including waited-for
+    child processes) and named counters. Phases append one JSON
+    record each to metrics_file as they end, with the phase's own peak RSS of
+    this process (peak_rss_mb, Linux only) and the lifetime peak including
+    worker processes (cumulative_peak_rss_mb). Spans are meant for hot loops:
+    repeated entries of the same span are aggregated into the enclosing phase's record.
+
+    With profile_dir set, each phase is also profiled with cProfile (see profiler.PhaseProfiler).
+    """
+
+    def __init__(self, log_file="execution_log.txt", metrics_file=None, profile_dir=None):
+        global _active_logger
         self.log_file = log_file
+        self.metrics_file = metrics_file or os.path.splitext(log_file)[0] + ".jsonl"
         self.start_times = {}
         self.logs = []
+        self.stack = []
+        self.phase_records = []
+        self.run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.run_start = time.time()
+        self.run_cpu_start = cpu_seconds()
+        # resetting VmHWM also resets ru_maxrss, so the run's own high-water mark is kept here
+        self.run_peak_rss_mb = 0.0
+        self.profiler = None
+        if profile_dir:
+            from profiler import PhaseProfiler
+            self.profiler = PhaseProfiler(profile_dir)
+        _active_logger = self
+        self.write_record({'type': 'run_start', 'argv': sys.argv, 'pid': os.getpid()})
+        
+    def write_record(self, record):
+        record = dict(record, run_id=self.run_id, time=round(time.time(), 3))
+        try:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            print(f"Warning: Could not write metrics record: {e}")
+    
+    def open_span(self, name):
+        entry = {'name': name, 'wall_start': time.time(), 'cpu_start': cpu_seconds(),
+                 'counters': {}, 'spans': {}}
+        self.stack.append(entry)
+        return entry
+    
+    def close_span(self, entry):
+        self.stack.remove(entry)
+        return {
+            'wall_seconds': round(time.time() - entry['wall_start'], 4),
+            'cpu_seconds': round(cpu_seconds() - entry['cpu_start'], 4)
+        }
+    
+    def count(self, name, value=1):
+        if not self.stack:
+            return
+        counters = self.stack[-1]['counters']
+        counters[name] = counters.get(name, 0) + value
+    
+    @contextmanager
+    def span(self, name):
+        entry = self.open_span(name)
+        try:
+            yield entry
+        finally:
+            timing = self.close_span(entry)
+            if self.stack:
+                # aggregate into the parent: a span inside a loop becomes one entry with a call count
+                parent = self.stack[-1]
+                merge_span(parent['spans'], name, 1, timing['wall_seconds'], timing['cpu_seconds'],
+                           entry['counters'])
+                for key, value in entry['spans'].items():
+                    merge_span(parent['spans'], f"{name}/{key}", value['calls'], value['wall_seconds'],
+                               value['cpu_seconds'], value['counters'])
+                # counters also roll up, so a phase reports totals for everything inside it
+                for key, value in entry['counters'].items():
+                    parent['counters'][key] = parent['counters'].get(key, 0) + value
+        
+    def fold_peak_rss(self):
+        # VmHWM is reset when a phase starts, so every open phase keeps the highest value it has seen
+        peak = phase_peak_rss_mb()
+        if peak is None:
+            return
+        self.run_peak_rss_mb = max(self.run_peak_rss_mb, peak)
+        for entry in self.stack:
+            entry['peak_rss_mb'] = max(entry.get('peak_rss_mb', 0.0), peak)
+        
+    def cumulative_peak_rss_mb(self):
+        self.fold_peak_rss()
+        return max(self.run_peak_rss_mb, peak_rss_mb())
         
     def start_phase(self, phase_name):
-        self.start_times[phase_name] = time.time()
+        self.fold_peak_rss()
+        self.start_times[phase_name] = self.open_span(phase_name)['wall_start']
+        reset_phase_peak_rss()
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_entry = f"[{timestamp}] Starting: {phase_name}"
         print(log_entry)
         self.logs.append(log_entry)
+        if self.profiler is not None:
+            self.profiler.start(phase_name)
         
     def end_phase(self, phase_name, details=""):
         if phase_name not in self.start_times:
@@ -29,6 +188,32 @@ class ExecutionLogger:
         self.logs.append(log_entry)
         
         del self.start_times[phase_name]
+        profile_path = self.profiler.stop(phase_name) if self.profiler is not None else None
+        
+        self.fold_peak_rss()
+        entry = next((e for e in reversed(self.stack) if e['name'] == phase_name), None)
+        if entry is not None:
+            timing = self.close_span(entry)
+            record = {
+                'type': 'phase',
+                'name': phase_name,
+                'parent': self.stack[-1]['name'] if self.stack else None,
+                'wall_seconds': timing['wall_seconds'],
+                'cpu_seconds': timing['cpu_seconds'],
+                # ~1.0 is one busy core, >1 means worker processes, well below 1 means waiting on I/O
+                'cpu_utilization': round(timing['cpu_seconds'] / timing['wall_seconds'], 3)
+                                   if timing['wall_seconds'] > 0 else None,
+                'peak_rss_mb': round(entry['peak_rss_mb'], 1) if 'peak_rss_mb' in entry else None,
+                # ru_maxrss never goes down: the run's peak so far, worker processes included
+                'cumulative_peak_rss_mb': round(self.cumulative_peak_rss_mb(), 1),
+                'counters': entry['counters'],
+                'spans': entry['spans'],
+                'details': details
+            }
+            if profile_path is not None:
+                record['profile'] = profile_path
+            self.phase_records.append(record)
+            self.write_record(record)
         return elapsed
     
     def log(self, message):
@@ -48,3 +233,14 @@ class ExecutionLogger:
             f.write("Log saved at: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\n")
             f.write("=" * 80 + "\n")
         print(f"\nExecution log saved to: {self.log_file}")
+        
+        self.write_record({
+            'type': 'run_end',
+            'wall_seconds': round(time.time() - self.run_start, 4),
+            'cpu_seconds': round(cpu_seconds() - self.run_cpu_start, 4),
+            'peak_rss_mb': round(self.cumulative_peak_rss_mb(), 1),
+            'phases': len(self.phase_records)
+        })
+        print(f"Metrics appended to: {self.metrics_file}")
+        if self.profiler is not None:
+            self.profiler.close()
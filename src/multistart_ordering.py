@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from local_search import build_neighbor_lists, optimize_path, edge_weight_function
+from greedy_edge import greedy_edge_path
+from logger import count
+from profiler import start_worker_profile
+
+
+_worker_state = {}
+
+KICK_SEGMENT_LENGTH = 50
+
+
+def _init_worker(similarity, neighbors_k):
+    start_worker_profile()
+    _worker_state['similarity'] = similarity
+    _worker_state['neighbors_k'] = neighbors_k
+    _worker_state['neighbor_lists'] = build_neighbor_lists(similarity, k=neighbors_k)
+
+    # frames whose neighbours are strongest overall make good anchors for a restart
+    weight = edge_weight_function(similarity)
+    strength = [sum(weight(i, j) for j in neighbors) for i, neighbors in
+                enumerate(_worker_state['neighbor_lists'])]
+    _worker_state['high_degree'] = list(np.argsort(strength)[::-1][:max(1, len(strength) // 20)])
+
+
+def double_bridge_kick(path, rng, max_segment=KICK_SEGMENT_LENGTH):
+    # open-path double bridge: A B C D -> A C B D, with B and C kept short so the kick stays local
+    n = len(path)
+    if n < 8:
+        return list(path), list(path)
+    p1 = rng.randrange(1, n - 2)
+    p2 = min(n - 1, p1 + rng.randint(1, max_segment))
+    p3 = min(n, p2 + rng.randint(1, max_segment))
+    if p2 >= p3:
+        return list(path), list(path)
+    kicked = path[:p1] + path[p2:p3] + path[p1:p2] + path[p3:]
+    touched = [kicked[k] for k in (p1 - 1, p1, p1 + p3 - p2 - 1, p1 + p3 - p2, p3 - 1, p3)
+               if 0 <= k < n]
+    return kicked, touched
+
+
+def _run_restart(task):
+    from order_frames import build_path_nearest_neighbor, find_best_starting_pair, calculate_path_score
+
+    kind, seed, base_path, deadline = task
+    similarity = _worker_state['similarity']
+    neighbor_lists = _worker_state['neighbor_lists']
+    rng = random.Random(seed)
+    n = len(similarity)
+    active = None
+
+    # the first restart always completes so there is a path to return; every other
+    # construction gives up (returns None) once the deadline has passed
+    build_deadline = None if kind == 'greedy_edge' else deadline
+    if build_deadline is not None and time.time() > build_deadline:
+        return None
+    if kind == 'greedy_edge':
+        path = greedy_edge_path(similarity, k=_worker_state['neighbors_k'])
+    elif kind == 'best_pair':
+        path = build_path_nearest_neighbor(similarity, find_best_starting_pair(similarity)[0][0],
+                                           deadline=build_deadline)
+    elif kind == 'high_degree':
+        path = build_path_nearest_neighbor(similarity, int(rng.choice(_worker_state['high_degree'])),
+                                           deadline=build_deadline)
+    elif kind == 'kick':
+        path, active = double_bridge_kick(base_path, rng)
+    else:
+        path = build_path_nearest_neighbor(similarity, rng.randrange(n), deadline=build_deadline)
+    if path is None:
+        return None
+
+    path, _ = optimize_path(path, similarity, neighbor_lists=neighbor_lists, active=active, deadline=deadline)
+    return calculate_path_score(path, similarity), path, kind
+
+
+def next_restart_kind(task_index, have_best):
+    if task_index == 0:
+        return 'greedy_edge'
+    if task_index == 1:
+        return 'best_pair'
+    # once a best path exists, most restarts perturb it (iterated local search)
+    if have_best and task_index % 3 != 0:
+        return 'kick'
+    return 'high_degree' if task_index % 2 == 0 else 'random'
+
+
+def find_path_multistart(similarity, time_budget=30.0, workers=None, neighbors_k=10, seed=0):
+    """Run construction + local-search restarts on a process pool until time_budget
+    seconds have passed; returns the best path, its score and a score-vs-time history."""
+    workers = workers or os.cpu_count() or 1
+    start_time = time.time()
+    deadline = start_time + time_budget
+
+    print(f"\nMulti-start ordering: {workers} workers, {time_budget:.1f}s budget")
+
+    best_path, best_score = None, -1
+    history = []
+    completed = 0
+    task_index = 0
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(similarity, neighbors_k))
+    try:
+        pending = set()
+        while True:
+            while len(pending) < workers and time.time() < deadline:
+                kind = next_restart_kind(task_index, best_path is not None)
+                pending.add(executor.submit(_run_restart, (kind, seed + task_index, best_path, deadline)))
+                task_index += 1
+
+            if not pending:
+                break
+
+            remaining = deadline - time.time()
+            done, pending = wait(pending, timeout=max(remaining, 0) if best_path is not None else None,
+                                 return_when=FIRST_COMPLETED)
+
+            for future in done:
+                result = future.result()
+                if result is None:
+                    continue
+                score, path, kind = result
+                completed += 1
+                if score > best_score:
+                    best_score, best_path = score, path
+                    elapsed = time.time() - start_time
+                    history.append({'elapsed': round(elapsed, 3), 'score': int(best_score),
+                                    'restarts': completed, 'source': kind})
+                    print(f"  [{elapsed:7.2f}s] new best score {best_score} ({kind}, restart {completed})")
+
+            if time.time() >= deadline and best_path is not None:
+                break
+    finally:
+        # restarts still running stop at the deadline; waiting for them keeps the budget a
+        # bound and lets profiled workers write their stats before the phase closes
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    print(f"  Completed {completed} restarts, best score: {best_score}")
+    count('restarts', completed)
+    return best_path, best_score, history
+
+
+def save_history(history, output_file):
+    try:
+        with open(output_file, 'w') as f:
+            json.dump(history, f, indent=2)
+        print(f"Score-vs-time history saved to: {output_file}")
+        return True
+    except Exception as e:
+        print(f"Error saving history: {e}")
+        return False
@@ -0,0 +1,151 @@
+import os
+import json
+import numpy as np
+from tqdm import tqdm
+from global_descriptors import stack_global_descriptors
+from hamming_matcher import pack_descriptors, signed_bits, cross_check_counts
+from logger import count
+
+
+FRAME_GROUPS_FILE = "frame_groups.json"
+
+# cosine between global descriptors, a first filter only: the descriptor is a 32x18
+# thumbnail, so at 1080p a pan of a few pixels per frame stays far above it
+DUPLICATE_SIMILARITY = 0.999
+# share of the fewer keypoints that must cross-check match the representative,
+# confirming at feature resolution what the thumbnail cannot see
+DUPLICATE_MATCH_FRACTION = 0.8
+
+# with fewer representatives (a fully static clip) there is nothing to match or order;
+# expand_order still chains the frames inside each group
+MIN_REPRESENTATIVES_TO_ORDER = 3
+
+
+def confirm_members(frames_data, representative, candidates, min_fraction=DUPLICATE_MATCH_FRACTION, block_size=32):
+    # ORB cross-check matches of each candidate against the representative, a block of
+    # candidates at a time: a still shot can bring thousands of them
+    if len(candidates) == 0:
+        return candidates
+    query, query_count = pack_descriptors([frames_data[representative]])
+    query_bits, query_kp = signed_bits(query[0]), int(query_count[0])
+
+    confirmed = []
+    for start in range(0, len(candidates), block_size):
+        block = candidates[start:start + block_size]
+        packed, counts = pack_descriptors([frames_data[int(k)] for k in block])
+        if query_kp == 0:
+            confirmed.append(block[counts == 0])
+            continue
+        matches = cross_check_counts(query_bits, query_kp, signed_bits(packed), counts)
+        confirmed.append(block[matches >= min_fraction * np.minimum(counts, query_kp)])
+    return np.concatenate(confirmed)
+
+
+def group_near_duplicates(frames_data, threshold=DUPLICATE_SIMILARITY, block_size=1024,
+                          min_match_fraction=DUPLICATE_MATCH_FRACTION):
+    """Group near-identical frames by the cosine of their global descriptors.
+
+    Frames are visited in index order. The first frame not yet grouped becomes
+    a representative and takes every ungrouped frame within threshold of it
+    whose ORB descriptors also cross-check match at least min_match_fraction
+    of its keypoints. Members are compared with the representative only, so a
+    slow drift cannot chain a whole shot into one group.
+
+    Returns lists of frame indices, one per group, representative first and
+    the rest in index order; groups are ordered by their representative.
+    """
+    vectors = stack_global_descriptors(frames_data)
+    n = len(vectors)
+    print(f"\nGrouping near-duplicate frames (global descriptor cosine >= {threshold})...")
+
+    close = []
+    for start in tqdm(range(0, n, block_size), desc="Finding near-duplicates", unit="block"):
+        block = vectors[start:start + block_size] @ vectors.T
+        rows, cols = np.nonzero(block >= threshold)
+        close.extend(np.split(cols, np.searchsorted(rows, np.arange(1, len(block)))))
+
+    grouped = np.zeros(n, dtype=bool)
+    groups = []
+    for i in range(n):
+        if grouped[i]:
+            continue
+        # every frame before i is grouped already, so i leads its own group
+        candidates = close[i][~grouped[close[i]]]
+        candidates = confirm_members(frames_data, i, candidates[candidates != i], min_match_fraction)
+        members = np.union1d([i], candidates)
+        grouped[members] = True
+        groups.append([int(frame) for frame in members])
+
+    collapsed = n - len(groups)
+    count('near_duplicates', collapsed)
+    print(f"  {n} frames -> {len(groups)} representatives ({collapsed} near-duplicates collapsed, "
+          f"largest group {max((len(g) for g in groups), default=0)})")
+    return groups
+
+
+def representative_frames(frames_data, groups):
+    return [frames_data[group[0]] for group in groups]
+
+
+def order_group(members, vectors, previous=None):
+    """Members of one group as a nearest-neighbour chain by global descriptor
+    cosine, starting next to the previous frame of the output (or, for the
+    first group, at the member least like the rest: one end of a drift)."""
+    group_vectors = vectors[members]
+    similarity = group_vectors @ group_vectors.T
+    if previous is None:
+        current = int(np.argmin(similarity.sum(axis=1)))
+    else:
+        current = int(np.argmax(group_vectors @ vectors[previous]))
+
+    visited = np.zeros(len(members), dtype=bool)
+    chain = []
+    for _ in range(len(members)):
+        visited[current] = True
+        chain.append(members[current])
+        row = np.where(visited, -np.inf, similarity[current])
+        current = int(np.argmax(row))
+    return chain
+
+
+def expand_order(order, groups, frames_data=None):
+    """Group positions back to frames: every representative brings its whole
+    group along. Members come in index order, which is the jumbled order, unless
+    frames_data is given; then each group is chained by order_group."""
+    if frames_data is None:
+        return [frame for position in order for frame in groups[position]]
+
+    vectors = stack_global_descriptors(frames_data)
+    expanded = []
+    for position in order:
+        group = groups[position]
+        if len(group) == 1:
+            expanded.append(group[0])
+        else:
+            expanded.extend(order_group(group, vectors, expanded[-1] if expanded else None))
+    return expanded
+
+
+def collapse_order(order, groups):
+    # a full frame order back onto group positions, each group where its first member appears
+    position = {frame: p for p, group in enumerate(groups) for frame in group}
+    return list(dict.fromkeys(position[frame] for frame in order))
+
+
+def save_frame_groups(groups, num_frames, output_file, threshold=DUPLICATE_SIMILARITY):
+    print(f"Saving {len(groups)} frame groups to: {output_file}")
+    with open(output_file, 'w') as f:
+        json.dump({'num_frames': num_frames, 'threshold': threshold, 'groups': groups}, f)
+
+
+def load_frame_groups(input_file, num_frames):
+    """Groups written by save_frame_groups, or None without a groups file or when
+    it was written for a different number of frames."""
+    if not os.path.exists(input_file):
+        return None
+    with open(input_file, 'r') as f:
+        data = json.load(f)
+    if data['num_frames'] != num_frames:
+        print(f"Warning: {input_file} covers {data['num_frames']} frames, not {num_frames}; ignoring it")
+        return None
+    return data['groups']
@@ -1,12 +1,31 @@
 import numpy as np
 import pickle
 import os
+import time
+import argparse
 from tqdm import tqdm
+from sparse_similarity import KNNGraph
+from packed_similarity import PackedSimilarity
+from local_search import optimize_path, edge_weight_function
+from greedy_edge import greedy_edge_path
+from feature_store import FeatureStore, frame_filenames, is_feature_store, locate_features
+from near_duplicates import FRAME_GROUPS_FILE, MIN_REPRESENTATIVES_TO_ORDER, load_frame_groups, representative_frames, \
+    expand_order, collapse_order
+from logger import count, span
+from parallel_similarity import worker_count
 
 
 def load_similarity_matrix(matrix_file):
     print(f"Loading similarity matrix from: {matrix_file}")
     try:
+        if matrix_file.endswith('.npz') and PackedSimilarity.is_packed_file(matrix_file):
+            packed = PackedSimilarity.load(matrix_file)
+            print(f"Successfully loaded {len(packed)}x{len(packed)} packed similarity matrix")
+            return packed
+        if matrix_file.endswith('.npz'):
+            graph = KNNGraph.load(matrix_file)
+            print(f"Successfully loaded {len(graph)}-frame top-{graph.k} similarity graph")
+            return graph
         matrix = np.load(matrix_file)
         print(f"Successfully loaded {matrix.shape[0]}x{matrix.shape[1]} similarity matrix")
         return matrix
@@ -18,8 +37,12 @@ def load_similarity_matrix(matrix_file):
 def load_frames_data(features_file):
     print(f"Loading frame data from: {features_file}")
     try:
-        with open(features_file, 'rb') as f:
-            frames_data = pickle.load(f)
+        if is_feature_store(features_file):
+            # only the metadata table is read; descriptors stay on disk
+            frames_data = FeatureStore(features_file)
+        else:
+            with open(features_file, 'rb') as f:
+                frames_data = pickle.load(f)
         print(f"Successfully loaded data for {len(frames_data)} frames")
         return frames_data
     except Exception as e:
@@ -28,20 +51,61 @@ def load_frames_data(features_file):
 
 
 def find_best_starting_pair(similarity_matrix):
+    if isinstance(similarity_matrix, (KNNGraph, PackedSimilarity)):
+        return similarity_matrix.best_pair()
+    
     n = len(similarity_matrix)
     max_similarity = -1
     best_pair = (0, 1)
     
     for i in range(n):
+        row = similarity_matrix[i]
         for j in range(i + 1, n):
-            if similarity_matrix[i][j] > max_similarity:
-                max_similarity = similarity_matrix[i][j]
+            if row[j] > max_similarity:
+                max_similarity = row[j]
                 best_pair = (i, j)
     
     return best_pair, max_similarity
 
 
-def build_path_nearest_neighbor(similarity_matrix, start_idx):
+def build_path_nearest_neighbor_sparse(graph, start_idx, deadline=None):
+    n = len(graph)
+    visited = [False] * n
+    path = [start_idx]
+    visited[start_idx] = True
+    current = start_idx
+    first_unvisited = 0
+    
+    for _ in range(n - 1):
+        if deadline is not None and time.time() > deadline:
+            return None
+        max_sim = 0
+        next_frame = -1
+        
+        for j, sim in graph.edges[current].items():
+            # ties go to the lowest index, like the dense scan
+            if not visited[j] and (sim > max_sim or (sim == max_sim and j < next_frame)):
+                max_sim = sim
+                next_frame = j
+        
+        # no stored edge left: every remaining frame scores 0, take the lowest index
+        if next_frame == -1:
+            while visited[first_unvisited]:
+                first_unvisited += 1
+            next_frame = first_unvisited
+        
+        path.append(next_frame)
+        visited[next_frame] = True
+        current = next_frame
+    
+    return path
+
+
+def build_path_nearest_neighbor(similarity_matrix, start_idx, deadline=None):
+    # with a deadline, returns None if it passes before the path is complete
+    if isinstance(similarity_matrix, KNNGraph):
+        return build_path_nearest_neighbor_sparse(similarity_matrix, start_idx, deadline=deadline)
+    
     n = len(similarity_matrix)
     visited = [False] * n
     path = [start_idx]
@@ -49,12 +113,15 @@ def build_path_nearest_neighbor(similarity_matrix, start_idx):
     current = start_idx
     
     for _ in range(n - 1):
+        if deadline is not None and time.time() > deadline:
+            return None
         max_sim = -1
         next_frame = -1
+        row = similarity_matrix[current]
         
         for j in range(n):
-            if not visited[j] and similarity_matrix[current][j] > max_sim:
-                max_sim = similarity_matrix[current][j]
+            if not visited[j] and row[j] > max_sim:
+                max_sim = row[j]
                 next_frame = j
         
         if next_frame == -1:
@@ -71,45 +138,19 @@ def build_path_nearest_neighbor(similarity_matrix, start_idx):
 
 
 def calculate_path_score(path, similarity_matrix):
+    weight = edge_weight_function(similarity_matrix)
     score = 0
     for i in range(len(path) - 1):
-        score += similarity_matrix[path[i]][path[i + 1]]
+        score += weight(path[i], path[i + 1])
     return score
 
 
-def optimize_path_2opt(path, similarity_matrix, max_iterations=1000):
-    n = len(path)
-    improved = True
-    iteration = 0
-    
-    while improved and iteration < max_iterations:
-        improved = False
-        for i in range(1, n - 2):
-            for j in range(i + 1, n):
-                if j - i == 1:
-                    continue
-                
-                new_path = path[:i] + path[i:j][::-1] + path[j:]
-                
-                old_score = (similarity_matrix[path[i-1]][path[i]] + 
-                           similarity_matrix[path[j-1]][path[j % n]])
-                new_score = (similarity_matrix[new_path[i-1]][new_path[i]] + 
-                           similarity_matrix[new_path[j-1]][new_path[j % n]])
-                
-                if new_score > old_score:
-                    path = new_path
-                    improved = True
-                    break
-            if improved:
-                break
-        iteration += 1
-    
-    return path, iteration
+def optimize_path_2opt(path, similarity_matrix, max_iterations=None, neighbors_k=10):
+    # 2-opt + Or-opt over each frame's top-k neighbours; returns the number of moves applied
+    return optimize_path(path, similarity_matrix, neighbors_k=neighbors_k, max_moves=max_iterations)
 
 
-def find_optimal_path_graph_approach(similarity_matrix):
-    print("\nFinding optimal frame order using graph-based approach...")
-    
+def build_initial_path_nearest_neighbor(similarity_matrix):
     print("Step 1: Finding best starting pair (highest similarity frames)")
     best_pair, max_sim = find_best_starting_pair(similarity_matrix)
     print(f"  Best pair: Frame {best_pair[0]} and {best_pair[1]} (similarity: {max_sim})")
@@ -125,33 +166,100 @@ def find_optimal_path_graph_approach(similarity_matrix):
     print(f"  Path from frame {best_pair[1]}: score = {score2}")
     
     if score1 > score2:
-        best_path = path1
-        best_score = score1
         print(f"  Selected path starting from frame {best_pair[0]}")
+        return path1, score1
     else:
-        best_path = path2
-        best_score = score2
         print(f"  Selected path starting from frame {best_pair[1]}")
+        return path2, score2
+
+
+def build_initial_path_greedy_edge(similarity_matrix, neighbors_k=10):
+    print("Steps 1-2: Building initial path with greedy edge matching")
+    print(f"  Sorting candidate edges (top-{neighbors_k} per frame) and accepting the best ones")
+    print("  that keep every frame at degree <= 2 without closing a cycle")
+    path = greedy_edge_path(similarity_matrix, k=neighbors_k)
+    score = calculate_path_score(path, similarity_matrix)
+    print(f"  Greedy edge path: score = {score}")
+    return path, score
+
+
+PATH_CONSTRUCTORS = {
+    "nearest_neighbor": build_initial_path_nearest_neighbor,
+    "greedy_edge": build_initial_path_greedy_edge,
+}
+
+
+def find_optimal_path_graph_approach(similarity_matrix, constructor="nearest_neighbor"):
+    print("\nFinding optimal frame order using graph-based approach...")
+    
+    if constructor not in PATH_CONSTRUCTORS:
+        raise ValueError(f"Unknown path constructor: {constructor}")
+    with span('construction'):
+        best_path, best_score = PATH_CONSTRUCTORS[constructor](similarity_matrix)
     
-    print(f"\nStep 3: Applying 2-opt optimization to improve path...")
-    optimized_path, iterations = optimize_path_2opt(best_path.copy(), similarity_matrix)
+    print(f"\nStep 3: Applying 2-opt / Or-opt local search to improve path...")
+    with span('local_search'):
+        optimized_path, moves = optimize_path_2opt(best_path.copy(), similarity_matrix)
     optimized_score = calculate_path_score(optimized_path, similarity_matrix)
+    count('local_search_moves', moves)
     
-    print(f"  Optimization completed in {iterations} iterations")
+    print(f"  Optimization completed with {moves} improving moves")
     print(f"  Initial score: {best_score}")
     print(f"  Optimized score: {optimized_score}")
-    print(f"  Improvement: {optimized_score - best_score} ({((optimized_score - best_score) / best_score * 100):.2f}%)")
+    if best_score > 0:
+        print(f"  Improvement: {optimized_score - best_score} ({((optimized_score - best_score) / best_score * 100):.2f}%)")
     
     return optimized_path, optimized_score
 
 
-def save_frame_order(order, frames_data, output_file):
+def find_optimal_path_multistart(similarity_matrix, time_budget, workers=None, history_file=None):
+    from multistart_ordering import find_path_multistart, save_history
+    
+    path, score, history = find_path_multistart(similarity_matrix, time_budget=time_budget, workers=workers)
+    
+    print("\nScore vs. time:")
+    for entry in history:
+        print(f"  {entry['elapsed']:8.2f}s  {entry['score']}  ({entry['source']})")
+    if history_file:
+        save_history(history, history_file)
+    
+    return path, score
+
+
+def find_optimal_path_banded(approx_order, frames_data, window=5, method="bruteforce"):
+    from banded_refinement import refine_order_banded
+    
+    with span('banded_refinement'):
+        path, score, graph = refine_order_banded(approx_order, frames_data, window=window, method=method)
+    return path, score, graph
+
+
+def find_optimal_path_hierarchical(frames_data, method="batched", max_cluster_size=500, workers=1):
+    from hierarchical_ordering import order_frames_hierarchical
+    
+    print("\nFinding frame order hierarchically: cluster, order each cluster, stitch...")
+    with span('hierarchical'):
+        path, score, graph = order_frames_hierarchical(frames_data, method=method,
+                                                       max_cluster_size=max_cluster_size, workers=workers)
+    return path, score, graph
+
+
+def load_approximate_order(order_file):
+    print(f"Loading approximate order from: {order_file}")
+    with open(order_file, 'rb') as f:
+        return list(pickle.load(f)['frame_indices'])
+
+
+def save_frame_order(order, frames_data, output_file, streamed=False):
+    # streamed: the frames were never written to frames/ (run_pipeline.py --streaming)
     print(f"\nSaving frame order to: {output_file}")
+    filenames = frame_filenames(frames_data)
     
     order_data = {
         'frame_indices': order,
-        'frame_filenames': [frames_data[i]['filename'] for i in order],
-        'num_frames': len(order)
+        'frame_filenames': [filenames[i] for i in order],
+        'num_frames': len(order),
+        'streamed': streamed
     }
     
     try:
@@ -170,12 +278,14 @@ def print_order_statistics(order, frames_data, similarity_matrix):
     print("=" * 60)
     
     print(f"Total frames ordered: {len(order)}")
-    print(f"First frame: {frames_data[order[0]]['filename']} (index {order[0]})")
-    print(f"Last frame: {frames_data[order[-1]]['filename']} (index {order[-1]})")
+    filenames = frame_filenames(frames_data)
+    print(f"First frame: {filenames[order[0]]} (index {order[0]})")
+    print(f"Last frame: {filenames[order[-1]]} (index {order[-1]})")
     
+    weight = edge_weight_function(similarity_matrix)
     similarities = []
     for i in range(len(order) - 1):
-        sim = similarity_matrix[order[i]][order[i + 1]]
+        sim = weight(order[i], order[i + 1])
         similarities.append(sim)
     
     print(f"\nConsecutive frame similarities:")
@@ -192,17 +302,48 @@ def print_order_statistics(order, frames_data, similarity_matrix):
     print("=" * 60)
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Determine the optimal frame order")
+    parser.add_argument("--similarity", default="similarity_matrix.npy",
+                        help="Dense similarity_matrix.npy, packed similarity_matrix.npz or sparse similarity_graph.npz "
+                             "(relative to the project root)")
+    parser.add_argument("--constructor", choices=sorted(PATH_CONSTRUCTORS), default="nearest_neighbor",
+                        help="Initial path construction before local search")
+    parser.add_argument("--time-budget", type=float, default=0,
+                        help="Run parallel multi-start search for this many seconds (0 = single run)")
+    parser.add_argument("--workers", type=worker_count, default=0,
+                        help="Worker processes for multi-start search (0 = all cores)")
+    parser.add_argument("--refine-window", type=int, default=0,
+                        help="Refine the order with exact ORB matches between frames within W positions of "
+                             "each other, widening around weak links (0 = off)")
+    parser.add_argument("--approximate-order", default=None,
+                        help="frame_order.pkl to refine instead of ordering --similarity first "
+                             "(relative to the project root)")
+    parser.add_argument("--refine-method", choices=("bruteforce", "batched"), default="bruteforce",
+                        help="ORB matching backend for the refinement band")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Cluster frames by global descriptor, order each cluster in parallel and stitch "
+                             "the clusters by their endpoint frames (no similarity matrix needed)")
+    parser.add_argument("--cluster-size", type=int, default=500,
+                        help="Largest cluster for --hierarchical; bounds memory and per-cluster work")
+    parser.add_argument("--cluster-method", choices=("bruteforce", "batched", "global"), default="batched",
+                        help="Similarity used inside clusters and between their endpoints for --hierarchical")
+    return parser.parse_args()
+
+
+def main(similarity_file="similarity_matrix.npy", constructor="nearest_neighbor", time_budget=0, workers=0,
+         refine_window=0, approximate_order=None, refine_method="bruteforce", hierarchical=False,
+         cluster_size=500, cluster_method="batched"):
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    matrix_file = os.path.join(project_root, "similarity_matrix.npy")
-    features_file = os.path.join(project_root, "frames_features.pkl")
+    matrix_file = os.path.join(project_root, similarity_file)
+    features_file = locate_features(project_root)
     output_file = os.path.join(project_root, "frame_order.pkl")
     
     print("=" * 60)
     print("STEP 5: DETERMINE OPTIMAL FRAME ORDER")
     print("=" * 60)
     
-    if not os.path.exists(matrix_file):
+    if approximate_order is None and not hierarchical and not os.path.exists(matrix_file):
         print(f"Error: Similarity matrix not found at {matrix_file}")
         print("Please run build_similarity_matrix.py first.")
         return
@@ -212,18 +353,57 @@ def main():
         print("Please run extract_features.py first.")
         return
     
-    similarity_matrix = load_similarity_matrix(matrix_file)
     frames_data = load_frames_data(features_file)
+    needs_matrix = approximate_order is None and not hierarchical
+    similarity_matrix = load_similarity_matrix(matrix_file) if needs_matrix else None
     
-    if similarity_matrix is None or frames_data is None:
+    if frames_data is None or (similarity_matrix is None and needs_matrix):
         print("Failed to load required data. Exiting.")
         return
     
-    optimal_order, score = find_optimal_path_graph_approach(similarity_matrix)
+    # with near-duplicate groups from build_similarity_matrix.py --dedup, only representatives are ordered
+    all_frames = frames_data
+    groups = load_frame_groups(os.path.join(project_root, FRAME_GROUPS_FILE), len(frames_data))
+    if groups is not None:
+        frames_data = representative_frames(all_frames, groups)
+        print(f"Ordering {len(frames_data)} representatives of {len(all_frames)} frames (near-duplicate groups)")
+    
+    if needs_matrix and len(similarity_matrix) != len(frames_data):
+        print(f"Error: the similarity matrix covers {len(similarity_matrix)} frames, not {len(frames_data)}")
+        print("Please rebuild it with build_similarity_matrix.py.")
+        return
+    
+    too_few_to_order = groups is not None and len(groups) < MIN_REPRESENTATIVES_TO_ORDER
+    if too_few_to_order:
+        print(f"Only {len(groups)} near-duplicate groups: nothing to order")
+        optimal_order, score = list(range(len(frames_data))), 0
+        refine_window = 0
+    elif hierarchical:
+        optimal_order, score, similarity_matrix = find_optimal_path_hierarchical(
+            frames_data, method=cluster_method, max_cluster_size=cluster_size, workers=workers)
+    elif approximate_order is not None:
+        # refine a saved order (e.g. from a cheap --method global run) without any similarity matrix
+        optimal_order = load_approximate_order(os.path.join(project_root, approximate_order))
+        if groups is not None:
+            optimal_order = collapse_order(optimal_order, groups)
+        refine_window = refine_window or 5
+    elif time_budget > 0:
+        history_file = os.path.join(project_root, "ordering_history.json")
+        optimal_order, score = find_optimal_path_multistart(similarity_matrix, time_budget, workers=workers,
+                                                            history_file=history_file)
+    else:
+        optimal_order, score = find_optimal_path_graph_approach(similarity_matrix, constructor=constructor)
+    
+    if refine_window > 0:
+        optimal_order, score, similarity_matrix = find_optimal_path_banded(optimal_order, frames_data,
+                                                                           window=refine_window, method=refine_method)
     
-    print_order_statistics(optimal_order, frames_data, similarity_matrix)
+    if not too_few_to_order:
+        print_order_statistics(optimal_order, frames_data, similarity_matrix)
     
-    success = save_frame_order(optimal_order, frames_data, output_file)
+    if groups is not None:
+        optimal_order = expand_order(optimal_order, groups, all_frames)
+    success = save_frame_order(optimal_order, all_frames, output_file)
     
     if success:
         print("\nPhase 5A Complete.")
@@ -235,4 +415,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(similarity_file=args.similarity, constructor=args.constructor, time_budget=args.time_budget,
+         workers=args.workers, refine_window=args.refine_window, approximate_order=args.approximate_order,
+         refine_method=args.refine_method, hierarchical=args.hierarchical, cluster_size=args.cluster_size,
+         cluster_method=args.cluster_method)
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+PACKED_DTYPE = np.uint16
+
+
+class PackedSimilarity:
+    """Symmetric similarity matrix stored as its strict upper triangle.
+
+    values holds the n*(n-1)/2 pairs (i, j), i < j, row by row in uint16 (match
+    counts never exceed the ORB feature budget). Row i is one contiguous slice
+    for j > i plus a strided gather for j < i; the diagonal reads as 0.
+    """
+
+    def __init__(self, n, values):
+        self.n = int(n)
+        self.values = np.asarray(values, dtype=PACKED_DTYPE)
+        if len(self.values) != self.n * (self.n - 1) // 2:
+            raise ValueError(f"Expected {self.n * (self.n - 1) // 2} packed values, got {len(self.values)}")
+        i = np.arange(self.n, dtype=np.int64)
+        # position of pair (i, i + 1); pair (i, j) lives at row_offsets[i] + j - i - 1
+        self.row_offsets = i * self.n - i * (i + 1) // 2
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def index(self, i, j):
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        return self.row_offsets[i] + j - i - 1
+
+    def weight(self, i, j):
+        if i == j:
+            return 0
+        if i > j:
+            i, j = j, i
+        return int(self.values[self.row_offsets[i] + j - i - 1])
+
+    def pair_weights(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        weights = np.zeros(np.broadcast(rows, cols).shape, dtype=np.int32)
+        off_diagonal = rows != cols
+        weights[off_diagonal] = self.values[self.index(rows, cols)[off_diagonal]]
+        return weights
+
+    def row(self, i):
+        row = np.zeros(self.n, dtype=np.int32)
+        start = self.row_offsets[i]
+        row[i + 1:] = self.values[start:start + self.n - i - 1]
+        if i > 0:
+            before = np.arange(i)
+            row[:i] = self.values[self.row_offsets[before] + i - before - 1]
+        return row
+
+    def rows(self, start, stop):
+        stop = min(stop, self.n)
+        return np.stack([self.row(i) for i in range(start, stop)]) if stop > start \
+            else np.zeros((0, self.n), dtype=np.int32)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.weight(*key)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.n)
+            if step != 1:
+                raise IndexError("PackedSimilarity only supports contiguous row slices")
+            return self.rows(start, stop)
+        return self.row(key)
+
+    def submatrix(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        return self.pair_weights(indices[:, None], indices[None, :])
+
+    def best_pair(self):
+        if len(self.values) == 0:
+            return (0, 1), 0
+        # the first maximum in row-major order, like a scan of the dense upper triangle
+        k = int(self.values.argmax())
+        i = int(np.searchsorted(self.row_offsets, k, side='right')) - 1
+        return (i, int(k - self.row_offsets[i] + i + 1)), int(self.values[k])
+
+    def to_dense(self):
+        return self.rows(0, self.n)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        n = len(matrix)
+        values = np.empty(n * (n - 1) // 2, dtype=PACKED_DTYPE)
+        limit = np.iinfo(PACKED_DTYPE).max
+        start = 0
+        # row by row, so a memory-mapped matrix is never read into RAM at once
+        for i in range(n - 1):
+            row = np.asarray(matrix[i][i + 1:])
+            values[start:start + len(row)] = np.clip(row, 0, limit)
+            start += len(row)
+        return cls(n, values)
+
+    def save(self, output_file):
+        np.savez(output_file, n=np.int64(self.n), values=self.values)
+
+    @classmethod
+    def load(cls, input_file):
+        with np.load(input_file) as data:
+            return cls(int(data['n']), data['values'])
+
+    @staticmethod
+    def is_packed_file(input_file):
+        with np.load(input_file) as data:
+            return 'values' in data.files
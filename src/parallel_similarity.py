@@ -0,0 +1,123 @@
+import os
+import argparse
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from tqdm import tqdm
+from hamming_matcher import pack_descriptors, match_block
+from profiler import start_worker_profile
+
+
+_worker_state = {}
+
+
+def worker_count(value):
+    # argparse type for --workers: Pool(processes=-1) would fail with a bare ValueError
+    workers = int(value)
+    if workers < 0:
+        raise argparse.ArgumentTypeError(f"expected 0 (all cores) or a positive worker count, got {value}")
+    return workers
+
+
+def iter_upper_tiles(n, tile_size):
+    for r0 in range(0, n, tile_size):
+        for c0 in range(r0, n, tile_size):
+            yield r0, min(r0 + tile_size, n), c0, min(c0 + tile_size, n)
+
+
+def tile_pair_count(tile):
+    r0, r1, c0, c1 = tile
+    return sum(max(0, c1 - max(c0, i + 1)) for i in range(r0, r1))
+
+
+def compute_tile(tile, packed, counts, method):
+    from build_similarity_matrix import compare_frames
+
+    r0, r1, c0, c1 = tile
+    block = np.zeros((r1 - r0, c1 - c0), dtype=np.int32)
+
+    for i in range(r0, r1):
+        start = max(c0, i + 1)
+        if start >= c1:
+            continue
+        cols = np.arange(start, c1)
+
+        if method == "batched":
+            matches = match_block(packed, counts, i, cols)
+        else:
+            desc_i = packed[i, :counts[i]] if counts[i] > 0 else None
+            matches = [
+                compare_frames(desc_i, packed[j, :counts[j]] if counts[j] > 0 else None)
+                for j in cols
+            ]
+
+        block[i - r0, start - c0:] = matches
+
+    return block
+
+
+def _init_worker(descriptors_name, descriptors_shape, counts, matrix_name, n, method):
+    start_worker_profile()
+    descriptors_shm = shared_memory.SharedMemory(name=descriptors_name)
+    matrix_shm = shared_memory.SharedMemory(name=matrix_name)
+
+    _worker_state['descriptors_shm'] = descriptors_shm
+    _worker_state['matrix_shm'] = matrix_shm
+    _worker_state['packed'] = np.ndarray(descriptors_shape, dtype=np.uint8, buffer=descriptors_shm.buf)
+    _worker_state['matrix'] = np.ndarray((n, n), dtype=np.int32, buffer=matrix_shm.buf)
+    _worker_state['counts'] = counts
+    _worker_state['method'] = method
+
+
+def _run_tile(tile):
+    r0, r1, c0, c1 = tile
+    block = compute_tile(tile, _worker_state['packed'], _worker_state['counts'], _worker_state['method'])
+
+    # tiles never overlap, so workers can write their slice of both halves directly
+    matrix = _worker_state['matrix']
+    if r0 == c0:
+        matrix[r0:r1, c0:c1] = block + block.T
+    else:
+        matrix[r0:r1, c0:c1] = block
+        matrix[c0:c1, r0:r1] = block.T
+    return tile_pair_count(tile)
+
+
+def build_similarity_matrix_parallel(frames_data, workers=None, method="bruteforce", tile_size=32):
+    n = len(frames_data)
+    workers = workers or os.cpu_count() or 1
+
+    print(f"\nBuilding {n}x{n} similarity matrix...")
+    print(f"Comparing frame pairs in {tile_size}x{tile_size} tiles across {workers} worker processes ({method})...")
+
+    packed, counts = pack_descriptors(frames_data)
+
+    descriptors_shm = shared_memory.SharedMemory(create=True, size=max(packed.nbytes, 1))
+    matrix_shm = shared_memory.SharedMemory(create=True, size=max(n * n * 4, 1))
+
+    try:
+        shared_packed = np.ndarray(packed.shape, dtype=np.uint8, buffer=descriptors_shm.buf)
+        shared_packed[:] = packed
+        shared_matrix = np.ndarray((n, n), dtype=np.int32, buffer=matrix_shm.buf)
+        shared_matrix[:] = 0
+
+        tiles = list(iter_upper_tiles(n, tile_size))
+        total_comparisons = (n * (n - 1)) // 2
+        init_args = (descriptors_shm.name, packed.shape, counts, matrix_shm.name, n, method)
+
+        with Pool(processes=workers, initializer=_init_worker, initargs=init_args) as pool:
+            with tqdm(total=total_comparisons, desc="Computing similarities", unit="pair") as pbar:
+                for pairs_done in pool.imap_unordered(_run_tile, tiles):
+                    pbar.update(pairs_done)
+            # let the workers exit normally instead of being terminated, so their exit hooks run
+            pool.close()
+            pool.join()
+
+        similarity_matrix = shared_matrix.copy()
+        del shared_packed, shared_matrix
+    finally:
+        descriptors_shm.close()
+        descriptors_shm.unlink()
+        matrix_shm.close()
+        matrix_shm.unlink()
+
+    return similarity_matrix
@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+import glob
+import cProfile
+import pstats
+from multiprocessing import util
+
+
+PROFILE_DIR_ENV = "JUMBLED_PROFILE_DIR"
+PROFILE_PHASE_ENV = "JUMBLED_PROFILE_PHASE"
+
+# profiles of the phases currently open in this process, innermost last
+_phase_profiles = []
+
+
+def phase_slug(phase_name):
+    # "Phase 5A: Frame Order Optimization" -> "phase_5a_frame_order_optimization"
+    return re.sub(r'[^a-z0-9]+', '_', phase_name.lower()).strip('_')
+
+
+def function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        # built-ins and C extension methods, e.g. <method 'knnMatch' of 'cv2.DescriptorMatcher' objects>
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed_stacks(stats, min_seconds=1e-5, max_depth=64):
+    """Collapsed-stack lines ("root;caller;callee microseconds") for flamegraph.pl
+    or speedscope, rebuilt from cProfile's caller -> callee edges.
+
+    cProfile does not record full stacks, so a function's time under a caller is
+    split across that caller's own call paths in proportion to their share of it,
+    and recursion is cut at the first repeated frame.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    totals = {}
+
+    def walk(func, stack, scale):
+        tt, ct = entries[func][2], entries[func][3]
+        if tt * scale > 0:
+            key = ';'.join(stack)
+            totals[key] = totals.get(key, 0.0) + tt * scale
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, []):
+            callee_ct = entries[callee][3]
+            if callee_ct <= 0 or edge_ct * scale < min_seconds or function_label(callee) in stack:
+                continue
+            walk(callee, stack + [function_label(callee)], scale * edge_ct / callee_ct)
+
+    # functions already running when profiling started (and the profiler's own calls) have no callers
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, [function_label(func)], 1.0)
+
+    return [f"{stack} {int(round(seconds * 1e6))}" for stack, seconds in sorted(totals.items())
+            if seconds * 1e6 >= 1]
+
+
+def write_profile(stats, base_path):
+    # <base>.pstats for pstats/snakeviz, <base>.collapsed for flame graphs
+    stats.dump_stats(base_path + ".pstats")
+    with open(base_path + ".collapsed", 'w') as f:
+        for line in collapsed_stacks(stats):
+            f.write(line + "\n")
+    return base_path + ".pstats"
+
+
+def _dump_worker_profile(profile, path):
+    profile.disable()
+    profile.dump_stats(path)
+
+
+def start_worker_profile():
+    """Call from a pool initializer. While a phase is being profiled, profiles this
+    worker process and writes <phase>.worker-<pid>.pstats when it exits normally
+    (pool.close() + join(), or executor shutdown); terminate() loses the profile.
+    Without profiling this is one environment lookup."""
+    profile_dir = os.environ.get(PROFILE_DIR_ENV)
+    if not profile_dir:
+        return
+    # a forked worker inherits the parent's running phase profile; it must not keep recording into it
+    for profile in _phase_profiles:
+        profile.disable()
+    _phase_profiles.clear()
+
+    profile = cProfile.Profile()
+    path = os.path.join(profile_dir, f"{os.environ.get(PROFILE_PHASE_ENV, 'worker')}.worker-{os.getpid()}.pstats")
+    util.Finalize(None, _dump_worker_profile, args=(profile, path), exitpriority=100)
+    profile.enable()
+
+
+def profile_thread(target):
+    """Wrap a thread target so it is profiled into the current phase, like a pool
+    worker (cProfile only sees the thread that enabled it). Returns target
+    unchanged when profiling is off.
+
+    From Python 3.12 cProfile is built on sys.monitoring: one profile per process,
+    which already sees every thread, so while a phase profile is running the
+    thread is left to it."""
+    profile_dir = os.environ.get(PROFILE_DIR_ENV)
+    if not profile_dir:
+        return target
+    if _phase_profiles and sys.version_info >= (3, 12):
+        return target
+    phase = os.environ.get(PROFILE_PHASE_ENV, 'thread')
+
+    def run(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active; a dead thread would hang its consumer, so run unprofiled
+            return target(*args, **kwargs)
+        try:
+            return target(*args, **kwargs)
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(profile_dir, f"{phase}.thread-{os.getpid()}-{id(profile)}.pstats"))
+
+    return run
+
+
+class PhaseProfiler:
+    """One cProfile per pipeline phase, written to profile_dir as
+    <phase>.pstats and <phase>.collapsed.
+
+    Pool workers and profiled threads started during a phase write their own
+    <phase>.worker-*.pstats / <phase>.thread-*.pstats; close() merges them into
+    <phase>.workers.pstats and <phase>.workers.collapsed.
+    """
+
+    def __init__(self, profile_dir):
+        self.profile_dir = os.path.abspath(profile_dir)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.phases = []
+        self.slugs = []
+
+    def start(self, phase_name):
+        # cProfile allows one active profile per thread, so an enclosing phase pauses
+        if _phase_profiles:
+            _phase_profiles[-1].disable()
+        slug = phase_slug(phase_name)
+        for stale in glob.glob(os.path.join(self.profile_dir, f"{slug}.*")):
+            os.remove(stale)
+        self.phases.append((phase_name, slug, os.environ.get(PROFILE_PHASE_ENV)))
+        self.slugs.append(slug)
+        os.environ[PROFILE_DIR_ENV] = self.profile_dir
+        os.environ[PROFILE_PHASE_ENV] = slug
+
+        profile = cProfile.Profile()
+        _phase_profiles.append(profile)
+        profile.enable()
+
+    def stop(self, phase_name):
+        position = next((k for k in range(len(self.phases) - 1, -1, -1) if self.phases[k][0] == phase_name), None)
+        if position is None or position != len(_phase_profiles) - 1:
+            return None
+        profile = _phase_profiles.pop()
+        profile.disable()
+        _, slug, outer_slug = self.phases.pop(position)
+
+        if outer_slug is None:
+            os.environ.pop(PROFILE_DIR_ENV, None)
+            os.environ.pop(PROFILE_PHASE_ENV, None)
+        else:
+            os.environ[PROFILE_PHASE_ENV] = outer_slug
+
+        path = write_profile(pstats.Stats(profile), os.path.join(self.profile_dir, slug))
+        if _phase_profiles:
+            _phase_profiles[-1].enable()
+        return path
+
+    def close(self):
+        # worker processes write their profiles as they exit, which may be after their phase ended
+        for slug in dict.fromkeys(self.slugs):
+            parts = sorted(glob.glob(os.path.join(self.profile_dir, f"{slug}.worker-*.pstats")) +
+                           glob.glob(os.path.join(self.profile_dir, f"{slug}.thread-*.pstats")))
+            if parts:
+                write_profile(pstats.Stats(*parts), os.path.join(self.profile_dir, f"{slug}.workers"))
+        print(f"Phase profiles saved to: {self.profile_dir}")
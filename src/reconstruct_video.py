@@ -2,7 +2,12 @@ import cv2
 import numpy as np
 import pickle
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from frame_store import open_frame_store
+from logger import count
 
 
 def load_frame_order(order_file):
@@ -17,9 +22,8 @@ def load_frame_order(order_file):
         return None
 
 
-def get_video_properties(frames_dir, first_frame_filename):
-    first_frame_path = os.path.join(frames_dir, first_frame_filename)
-    frame = cv2.imread(first_frame_path)
+def get_video_properties(store, first_frame_filename):
+    frame = store.read_by_name(first_frame_filename)
     
     if frame is None:
         print(f"Error: Could not read first frame: {first_frame_filename}")
@@ -29,14 +33,40 @@ def get_video_properties(frames_dir, first_frame_filename):
     return width, height
 
 
-def reconstruct_video(order_data, frames_dir, output_path, fps=30):
+def iter_frames_prefetched(read, frame_names, prefetch=32, workers=4):
+    """Yield read(name) for each name in order while a thread pool reads up to
+    `prefetch` frames ahead; cv2.imread releases the GIL, so decoding overlaps the encoder."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        names = iter(frame_names)
+        for name in names:
+            pending.append(pool.submit(read, name))
+            if len(pending) >= prefetch:
+                break
+
+        # bounded reorder buffer: hand out the oldest request, then top the buffer up
+        while pending:
+            frame = pending.popleft().result()
+            next_name = next(names, None)
+            if next_name is not None:
+                pending.append(pool.submit(read, next_name))
+            yield frame
+
+
+def reconstruct_video(order_data, frames_dir, output_path, fps=30, prefetch=0, workers=4):
     print(f"\nReconstructing video...")
     print(f"Output: {output_path}")
     print(f"FPS: {fps}")
     
+    if order_data.get('streamed'):
+        print("Error: This frame order comes from a --streaming run whose frames were never saved to disk")
+        print("Reconstruct it from the source video with --from-video instead.")
+        return False
+    
     frame_filenames = order_data['frame_filenames']
+    store = open_frame_store(frames_dir)
     
-    width, height = get_video_properties(frames_dir, frame_filenames[0])
+    width, height = get_video_properties(store, frame_filenames[0])
     if width is None:
         return False
     
@@ -51,24 +81,81 @@ def reconstruct_video(order_data, frames_dir, output_path, fps=30):
     
     print(f"\nWriting {len(frame_filenames)} frames in correct order...")
     
-    for filename in tqdm(frame_filenames, desc="Writing frames", unit="frame"):
-        frame_path = os.path.join(frames_dir, filename)
-        frame = cv2.imread(frame_path)
-        
+    if prefetch > 0:
+        print(f"Decoding up to {prefetch} frames ahead with {workers} threads")
+        frames = iter_frames_prefetched(store.read_by_name, frame_filenames, prefetch=prefetch, workers=workers)
+    else:
+        frames = (store.read_by_name(filename) for filename in frame_filenames)
+    
+    written = 0
+    for filename, frame in tqdm(zip(frame_filenames, frames), total=len(frame_filenames),
+                                desc="Writing frames", unit="frame"):
         if frame is None:
             print(f"Warning: Could not read frame {filename}, skipping...")
             continue
         
         out.write(frame)
+        written += 1
+    
+    out.release()
+    count('frames_written', written)
+    print(f"\nVideo reconstruction complete!")
+    return True
+
+
+def reconstruct_from_video(order_data, video_path, output_path, fps=None, cache_frames=64):
+    from video_index import load_frame_index, frame_number, write_video_in_order
     
+    index = load_frame_index(video_path)
+    if index is None:
+        return False
+    
+    # frame_00042.jpg is frame 42 of the source video, whether or not frames/ still exists
+    order = [frame_number(filename) for filename in order_data['frame_filenames']]
+    return write_video_in_order(video_path, order, output_path, index, fps=fps, cache_frames=cache_frames)
+
+
+def write_frames_in_order(frames, order, output_path, fps=30):
+    print(f"\nReconstructing video from {len(order)} in-memory frames...")
+    print(f"Output: {output_path}")
+    print(f"FPS: {fps}")
+
+    height, width = frames[order[0]].shape[:2]
+    print(f"Resolution: {width}x{height}")
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    if not out.isOpened():
+        print(f"Error: Could not open video writer")
+        return False
+
+    for index in tqdm(order, desc="Writing frames", unit="frame"):
+        out.write(frames[index])
+
     out.release()
+    count('frames_written', len(order))
     print(f"\nVideo reconstruction complete!")
     return True
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write the ordered frames to a video")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="Decode up to N frames ahead of the encoder on a thread pool (0 = serial)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Decoder threads for --prefetch")
+    parser.add_argument("--from-video", action="store_true",
+                        help="Decode frames from jumbled_video.mp4 instead of reading frames/")
+    parser.add_argument("--cache-frames", type=int, default=64,
+                        help="Decoded frames kept in memory for --from-video")
+    return parser.parse_args()
+
+
+def main(prefetch=0, workers=4, from_video=False, cache_frames=64):
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     order_file = os.path.join(project_root, "frame_order.pkl")
+    video_path = os.path.join(project_root, "jumbled_video.mp4")
     frames_dir = os.path.join(project_root, "frames")
     output_dir = os.path.join(project_root, "output")
     output_video = os.path.join(output_dir, "reconstructed_video.mp4")
@@ -82,7 +169,11 @@ def main():
         print("Please run order_frames.py first.")
         return
     
-    if not os.path.exists(frames_dir):
+    if from_video and not os.path.exists(video_path):
+        print(f"Error: Source video not found at {video_path}")
+        return
+    
+    if not from_video and not os.path.exists(frames_dir):
         print(f"Error: Frames directory not found at {frames_dir}")
         return
     
@@ -96,7 +187,10 @@ def main():
         print("Failed to load frame order. Exiting.")
         return
     
-    success = reconstruct_video(order_data, frames_dir, output_video, fps=30)
+    if from_video:
+        success = reconstruct_from_video(order_data, video_path, output_video, fps=30, cache_frames=cache_frames)
+    else:
+        success = reconstruct_video(order_data, frames_dir, output_video, fps=30, prefetch=prefetch, workers=workers)
     
     if success:
         file_size = os.path.getsize(output_video) / (1024 * 1024)
@@ -115,4 +209,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(prefetch=args.prefetch, workers=args.workers, from_video=args.from_video, cache_frames=args.cache_frames)
@@ -2,12 +2,71 @@ import cv2
 import os
 import pickle
 import time
+import argparse
 from tqdm import tqdm
 from logger import ExecutionLogger
+from parallel_similarity import worker_count
 
 
-def main():
-    logger = ExecutionLogger("execution_log.txt")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the complete video reconstruction pipeline")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Decode, extract features and match in memory, skipping the frames/ round trip")
+    parser.add_argument("--method", choices=("bruteforce", "batched", "global"), default="bruteforce",
+                        help="Descriptor matching backend for the similarity matrix (global: thumbnail/histogram "
+                             "descriptors compared with one GEMM, not available with --streaming)")
+    parser.add_argument("--global-candidates", type=int, default=0,
+                        help="ORB-match only each frame's top-K neighbours by global descriptor (0 = all pairs)")
+    parser.add_argument("--workers", type=worker_count, default=1,
+                        help="Worker processes for features and matching (threads in streaming mode)")
+    parser.add_argument("--constructor", choices=("nearest_neighbor", "greedy_edge"), default="nearest_neighbor",
+                        help="Initial path construction before local search")
+    parser.add_argument("--time-budget", type=float, default=0,
+                        help="Seconds of parallel multi-start frame ordering (0 = single run)")
+    parser.add_argument("--feature-cache", default=None,
+                        help="Reuse per-frame ORB features across runs from this cache directory")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="Decode up to N frames ahead of the video encoder in Phase 5B (0 = serial)")
+    parser.add_argument("--from-video", action="store_true",
+                        help="Phase 5B decodes frames straight from jumbled_video.mp4 (with --streaming, "
+                             "decoded frames are not kept in RAM)")
+    parser.add_argument("--frame-store", choices=("jpeg", "raw"), default="jpeg",
+                        help="How Phase 2 stores frames for Phases 3 and 5B: JPEG files or one raw memmap")
+    parser.add_argument("--refine-window", type=int, default=0,
+                        help="After ordering, re-score frames within W positions of each other with exact ORB "
+                             "matches and run local search on that band (useful after --method global)")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Cluster frames into segments, order each cluster in parallel with --method and "
+                             "stitch clusters by their endpoint frames; skips the n x n matrix of Phase 4 "
+                             "(not available with --streaming)")
+    parser.add_argument("--cluster-size", type=int, default=500,
+                        help="Largest cluster for --hierarchical")
+    parser.add_argument("--feature-reduction", type=int, choices=(1, 2, 4, 8), default=1,
+                        help="Run ORB on grayscale frames decoded at 1/N resolution (1 = full resolution)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Collapse near-identical frames after Phase 3; match and order one representative "
+                             "per group and expand the groups in the final order (not available with --streaming)")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="Global descriptor cosine at or above which frames count as duplicates")
+    parser.add_argument("--profile", default=None, metavar="DIR",
+                        help="Profile every phase with cProfile (including worker processes) into DIR")
+    return parser.parse_args()
+
+
+def main(streaming=False, method="bruteforce", workers=1, constructor="nearest_neighbor", time_budget=0,
+         feature_cache=None, prefetch=0, from_video=False, frame_store="jpeg", profile_dir=None,
+         feature_reduction=1, global_candidates=0, refine_window=0, hierarchical=False, cluster_size=500,
+         dedup=False, dedup_threshold=None):
+    if streaming and method == "global":
+        print("Error: --method global needs the stored features; run without --streaming")
+        return
+    if streaming and dedup:
+        print("Error: --dedup groups frames before matching; run without --streaming")
+        return
+    if streaming and hierarchical:
+        print("Error: --hierarchical matches frames within clusters only; run without --streaming")
+        return
+    logger = ExecutionLogger("execution_log.txt", profile_dir=profile_dir)
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     
     logger.log("=" * 60)
@@ -22,54 +81,148 @@ def main():
     frames_dir = os.path.join(project_root, "frames")
     output_dir = os.path.join(project_root, "output")
     
-    if not os.path.exists(frames_dir):
+    if not streaming and not os.path.exists(frames_dir):
         os.makedirs(frames_dir)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
     logger.end_phase("Phase 1: Project Setup Verification", "Directories verified")
     
-    # Phase 2: Extract Frames
-    logger.start_phase("Phase 2: Frame Extraction")
-    from extract_frames import extract_frames
-    frame_count, fps, resolution = extract_frames(video_path, frames_dir)
-    logger.end_phase("Phase 2: Frame Extraction", f"{frame_count} frames extracted")
+    features_file = os.path.join(project_root, "frames_features")
+    matrix_file = os.path.join(project_root, "similarity_matrix.npy")
+    groups_file = os.path.join(project_root, "frame_groups.json")
+    groups = None
+    too_few_to_order = False
+    if not dedup and os.path.exists(groups_file):
+        # groups of an earlier --dedup run do not describe this run's matrix
+        os.remove(groups_file)
+    
+    if streaming:
+        # Phases 2-4: one in-memory pass, nothing touches disk until the artifacts are saved
+        logger.start_phase("Phases 2-4: Streaming Decode, Features and Matching")
+        from streaming_pipeline import stream_video_features
+        from extract_features import save_features
+        from build_similarity_matrix import save_similarity_matrix
+        streamed = stream_video_features(video_path, workers=max(workers, 1), method=method,
+                                         keep_frames=not from_video, reduction=feature_reduction)
+        if streamed is None:
+            print("Failed to stream video. Exiting.")
+            return
+        frames_data, similarity_matrix, frames, fps, resolution = streamed
+        frame_count = len(frames_data)
+        total_keypoints = sum(f['num_keypoints'] for f in frames_data)
+        logger.end_phase("Phases 2-4: Streaming Decode, Features and Matching",
+                        f"{frame_count} frames, {total_keypoints} total keypoints, "
+                        f"{len(similarity_matrix)}x{len(similarity_matrix)} matrix")
+        save_features(frames_data, features_file)
+        save_similarity_matrix(similarity_matrix, matrix_file)
+    else:
+        # Phase 2: Extract Frames
+        logger.start_phase("Phase 2: Frame Extraction")
+        from extract_frames import extract_frames
+        extracted = extract_frames(video_path, frames_dir, backend=frame_store)
+        if extracted is None:
+            print("Failed to extract frames. Exiting.")
+            return
+        frame_count, fps, resolution = extracted
+        logger.end_phase("Phase 2: Frame Extraction", f"{frame_count} frames extracted")
     
-    # Phase 3: Extract ORB Features
-    logger.start_phase("Phase 3: ORB Feature Extraction")
-    from extract_features import load_and_process_frames, save_features
-    frames_data = load_and_process_frames(frames_dir)
-    features_file = os.path.join(project_root, "frames_features.pkl")
-    save_features(frames_data, features_file)
-    total_keypoints = sum(f['num_keypoints'] for f in frames_data)
-    logger.end_phase("Phase 3: ORB Feature Extraction", 
-                    f"{total_keypoints} total keypoints, avg {total_keypoints/len(frames_data):.0f} per frame")
+        # Phase 3: Extract ORB Features
+        logger.start_phase("Phase 3: ORB Feature Extraction")
+        from extract_features import load_and_process_frames, save_features
+        cache = None
+        if feature_cache:
+            from feature_cache import FeatureCache
+            cache = FeatureCache(feature_cache)
+        frames_data = load_and_process_frames(frames_dir, workers=workers, cache=cache,
+                                              reduction=feature_reduction,
+                                              global_descriptors=(method == "global" or global_candidates > 0
+                                                                  or hierarchical or dedup))
+        save_features(frames_data, features_file)
+        total_keypoints = sum(f['num_keypoints'] for f in frames_data)
+        logger.end_phase("Phase 3: ORB Feature Extraction", 
+                        f"{total_keypoints} total keypoints, avg {total_keypoints/len(frames_data):.0f} per frame")
     
-    # Phase 4: Build Similarity Matrix
-    logger.start_phase("Phase 4: Similarity Matrix Construction")
-    from build_similarity_matrix import build_similarity_matrix, save_similarity_matrix
-    similarity_matrix = build_similarity_matrix(frames_data)
-    matrix_file = os.path.join(project_root, "similarity_matrix.npy")
-    save_similarity_matrix(similarity_matrix, matrix_file)
-    logger.end_phase("Phase 4: Similarity Matrix Construction", 
-                    f"{len(similarity_matrix)}x{len(similarity_matrix)} matrix")
+        # Phase 3B: Near-duplicate grouping; later phases see one representative per group
+        if dedup:
+            logger.start_phase("Phase 3B: Near-Duplicate Grouping")
+            from near_duplicates import DUPLICATE_SIMILARITY, MIN_REPRESENTATIVES_TO_ORDER, group_near_duplicates, \
+                representative_frames, save_frame_groups
+            threshold = dedup_threshold or DUPLICATE_SIMILARITY
+            groups = group_near_duplicates(frames_data, threshold=threshold)
+            save_frame_groups(groups, len(frames_data), groups_file, threshold=threshold)
+            all_frames, frames_data = frames_data, representative_frames(frames_data, groups)
+            too_few_to_order = len(groups) < MIN_REPRESENTATIVES_TO_ORDER
+            logger.end_phase("Phase 3B: Near-Duplicate Grouping",
+                            f"{len(all_frames)} frames, {len(groups)} representatives")
+    
+        # Phase 4: Build Similarity Matrix
+        if too_few_to_order:
+            logger.log(f"Skipping Phase 4: only {len(frames_data)} near-duplicate groups")
+        elif hierarchical:
+            # clusters are matched inside Phase 5A; no n x n matrix is ever built
+            logger.log("Skipping Phase 4: --hierarchical matches frames within clusters only")
+        else:
+            logger.start_phase("Phase 4: Similarity Matrix Construction")
+            from build_similarity_matrix import build_similarity_matrix, save_similarity_matrix
+            candidates = None
+            if global_candidates > 0 and method != "global":
+                from global_descriptors import global_candidate_pairs
+                candidates = global_candidate_pairs(frames_data, k=global_candidates)
+            similarity_matrix = build_similarity_matrix(frames_data, method=method, workers=workers,
+                                                        candidates=candidates)
+            save_similarity_matrix(similarity_matrix, matrix_file)
+            logger.end_phase("Phase 4: Similarity Matrix Construction", 
+                            f"{len(similarity_matrix)}x{len(similarity_matrix)} matrix")
     
     # Phase 5A: Determine Frame Order
     logger.start_phase("Phase 5A: Frame Order Optimization")
     from order_frames import find_optimal_path_graph_approach, save_frame_order
-    optimal_order, score = find_optimal_path_graph_approach(similarity_matrix)
+    if too_few_to_order:
+        optimal_order, score = list(range(len(frames_data))), 0
+    elif hierarchical:
+        from order_frames import find_optimal_path_hierarchical
+        optimal_order, score, _ = find_optimal_path_hierarchical(frames_data, method=method,
+                                                                 max_cluster_size=cluster_size, workers=workers)
+    elif time_budget > 0:
+        from order_frames import find_optimal_path_multistart
+        optimal_order, score = find_optimal_path_multistart(
+            similarity_matrix, time_budget, workers=workers,
+            history_file=os.path.join(project_root, "ordering_history.json"))
+    else:
+        optimal_order, score = find_optimal_path_graph_approach(similarity_matrix, constructor=constructor)
+    if refine_window > 0 and not too_few_to_order:
+        from order_frames import find_optimal_path_banded
+        optimal_order, score, _ = find_optimal_path_banded(optimal_order, frames_data, window=refine_window,
+                                                           method="batched" if method == "batched" else "bruteforce")
     order_file = os.path.join(project_root, "frame_order.pkl")
-    save_frame_order(optimal_order, frames_data, order_file)
-    avg_similarity = score / (len(optimal_order) - 1)
+    avg_similarity = score / max(len(optimal_order) - 1, 1)
+    if groups is not None:
+        from near_duplicates import expand_order
+        optimal_order, frames_data = expand_order(optimal_order, groups, all_frames), all_frames
+    save_frame_order(optimal_order, frames_data, order_file, streamed=streaming)
     logger.end_phase("Phase 5A: Frame Order Optimization", 
                     f"Path score: {score}, Avg similarity: {avg_similarity:.2f}")
     
     # Phase 5B: Reconstruct Video
     logger.start_phase("Phase 5B: Video Reconstruction")
-    from reconstruct_video import reconstruct_video, load_frame_order
-    order_data = load_frame_order(order_file)
     output_video = os.path.join(output_dir, "reconstructed_video.mp4")
-    reconstruct_video(order_data, frames_dir, output_video, fps=fps)
+    if from_video:
+        from reconstruct_video import reconstruct_from_video, load_frame_order
+        order_data = load_frame_order(order_file)
+        success = order_data is not None and reconstruct_from_video(order_data, video_path, output_video, fps=fps)
+    elif streaming:
+        from reconstruct_video import write_frames_in_order
+        success = write_frames_in_order(frames, optimal_order, output_video, fps=fps)
+    else:
+        from reconstruct_video import reconstruct_video, load_frame_order
+        order_data = load_frame_order(order_file)
+        success = order_data is not None and reconstruct_video(order_data, frames_dir, output_video, fps=fps,
+                                                               prefetch=prefetch,
+                                                               workers=workers or os.cpu_count() or 1)
+    if not success:
+        print("Video reconstruction failed. Exiting.")
+        return
     video_size = os.path.getsize(output_video) / (1024 * 1024)
     logger.end_phase("Phase 5B: Video Reconstruction", 
                     f"Output: {video_size:.2f}MB, {fps} FPS")
@@ -94,4 +247,11 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(streaming=args.streaming, method=args.method, workers=args.workers,
+         constructor=args.constructor, time_budget=args.time_budget, feature_cache=args.feature_cache,
+         prefetch=args.prefetch, from_video=args.from_video, frame_store=args.frame_store,
+         profile_dir=args.profile, feature_reduction=args.feature_reduction,
+         global_candidates=args.global_candidates, refine_window=args.refine_window,
+         hierarchical=args.hierarchical, cluster_size=args.cluster_size, dedup=args.dedup,
+         dedup_threshold=args.dedup_threshold)
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class SparseRow:
+    def __init__(self, edges):
+        self.edges = edges
+
+    def __getitem__(self, j):
+        return self.edges.get(j, 0)
+
+
+class KNNGraph:
+    """Fixed-width top-k neighbour lists with match-count weights.
+
+    neighbors[i] holds up to k frame indices (-1 = padding) and weights[i]
+    their similarities. Edges are undirected: an edge listed by either end is
+    visible from both, and any missing edge has weight 0.
+    """
+
+    def __init__(self, neighbors, weights):
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.int32)
+        self._edges = None
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.neighbors.nbytes + self.weights.nbytes
+
+    @property
+    def edges(self):
+        if self._edges is None:
+            edges = [dict() for _ in range(len(self))]
+            rows, slots = np.nonzero(self.neighbors >= 0)
+            for i, j, w in zip(rows.tolist(), self.neighbors[rows, slots].tolist(),
+                               self.weights[rows, slots].tolist()):
+                if w > edges[i].get(j, 0):
+                    edges[i][j] = w
+                    edges[j][i] = w
+            self._edges = edges
+        return self._edges
+
+    def __getitem__(self, i):
+        return SparseRow(self.edges[i])
+
+    def weight(self, i, j):
+        return self.edges[i].get(j, 0)
+
+    def neighbor_lists(self):
+        # symmetric lists, best first
+        return [sorted(row, key=row.get, reverse=True) for row in self.edges]
+
+    def edge_list(self):
+        # unique undirected edges (i < j) with their weights
+        rows, slots = np.nonzero(self.neighbors >= 0)
+        cols = self.neighbors[rows, slots]
+        pairs = np.stack([np.minimum(rows, cols), np.maximum(rows, cols)], axis=1)
+        pairs, first = np.unique(pairs, axis=0, return_index=True)
+        return pairs, self.weights[rows, slots][first]
+
+    def best_pair(self):
+        if self.weights.size == 0 or self.weights.max() <= 0:
+            return (0, 1), 0
+        i, slot = np.unravel_index(self.weights.argmax(), self.weights.shape)
+        j = int(self.neighbors[i, slot])
+        return (int(min(i, j)), int(max(i, j))), int(self.weights[i, slot])
+
+    @classmethod
+    def from_dense(cls, matrix, k=10, chunk_size=1024):
+        n = len(matrix)
+        k = min(k, max(n - 1, 1))
+        neighbors = np.full((n, k), -1, dtype=np.int32)
+        weights = np.zeros((n, k), dtype=np.int32)
+
+        for start in range(0, n, chunk_size):
+            rows = np.asarray(matrix[start:start + chunk_size], dtype=np.int64)
+            rows[np.arange(len(rows)), np.arange(start, start + len(rows))] = -1
+            top = np.argpartition(-rows, k - 1, axis=1)[:, :k]
+            values = np.take_along_axis(rows, top, axis=1)
+            order = np.argsort(-values, axis=1, kind='stable')
+            neighbors[start:start + len(rows)] = np.take_along_axis(top, order, axis=1)
+            weights[start:start + len(rows)] = np.take_along_axis(values, order, axis=1)
+
+        neighbors[weights <= 0] = -1
+        weights[weights <= 0] = 0
+        return cls(neighbors, weights)
+
+    @classmethod
+    def from_pairs(cls, n, pairs, values, k=10):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        values = np.asarray(values, dtype=np.int64)
+
+        nodes = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        others = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        weights_all = np.concatenate([values, values])
+        keep = weights_all > 0
+        nodes, others, weights_all = nodes[keep], others[keep], weights_all[keep]
+
+        # best-first within each node, then keep the first k per node
+        order = np.lexsort((-weights_all, nodes))
+        nodes, others, weights_all = nodes[order], others[order], weights_all[order]
+        group_start = np.searchsorted(nodes, nodes, side='left')
+        rank = np.arange(len(nodes)) - group_start
+        keep = rank < k
+
+        neighbors = np.full((n, k), -1, dtype=np.int32)
+        weights = np.zeros((n, k), dtype=np.int32)
+        neighbors[nodes[keep], rank[keep]] = others[keep]
+        weights[nodes[keep], rank[keep]] = weights_all[keep]
+        return cls(neighbors, weights)
+
+    def save(self, output_file):
+        np.savez_compressed(output_file, neighbors=self.neighbors, weights=self.weights)
+
+    @classmethod
+    def load(cls, input_file):
+        with np.load(input_file) as data:
+            return cls(data['neighbors'], data['weights'])
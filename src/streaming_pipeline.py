@@ -0,0 +1,190 @@
+import cv2
+import queue
+import threading
+import numpy as np
+from tqdm import tqdm
+from extract_features import ORB_FEATURES, create_orb_detector, extract_orb_features, warn_if_too_small
+from hamming_matcher import DESCRIPTOR_BYTES, match_block
+from build_similarity_matrix import MATCHING_METHODS, compare_frames
+from logger import count
+from profiler import profile_thread
+from frame_store import reduce_gray
+
+
+_DONE = object()
+
+
+class DescriptorBuffer:
+    """Growing packed descriptor tensor, filled as frames arrive."""
+
+    def __init__(self, capacity=256, max_kp=ORB_FEATURES):
+        self.packed = np.zeros((capacity, max_kp, DESCRIPTOR_BYTES), dtype=np.uint8)
+        self.counts = np.zeros(capacity, dtype=np.int32)
+        self.size = 0
+
+    def append(self, descriptors):
+        count = 0 if descriptors is None else len(descriptors)
+        capacity, max_kp = self.packed.shape[:2]
+
+        if self.size == capacity or count > max_kp:
+            grown = np.zeros((max(capacity * 2, self.size + 1), max(max_kp, count), DESCRIPTOR_BYTES),
+                             dtype=np.uint8)
+            grown[:self.size, :max_kp] = self.packed[:self.size]
+            self.packed = grown
+            self.counts = np.resize(self.counts, grown.shape[0])
+
+        if count > 0:
+            self.packed[self.size, :count] = descriptors
+        self.counts[self.size] = count
+        self.size += 1
+
+
+def _decode_frames(video, frame_queue, num_feature_workers, errors):
+    try:
+        index = 0
+        while True:
+            success, frame = video.read()
+            if not success:
+                break
+            frame_queue.put((index, frame))
+            index += 1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for _ in range(num_feature_workers):
+            frame_queue.put(_DONE)
+
+
+def _extract_features(frame_queue, features_queue, errors, reduction=1):
+    orb = create_orb_detector()
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is _DONE:
+                break
+
+            index, frame = item
+            # the full frame is kept for the output video; ORB may run on a reduced grayscale copy
+            image = reduce_gray(frame, reduction) if reduction > 1 else frame
+            keypoints, descriptors = extract_orb_features(image, orb)
+
+            frame_info = {
+                'filename': f"frame_{index:05d}.jpg",
+                'path': None,
+                'shape': image.shape,
+                'num_keypoints': len(keypoints) if keypoints else 0,
+                'descriptors': descriptors,
+                # nothing that runs with --streaming uses global descriptors
+                'global_descriptor': None
+            }
+            features_queue.put((index, frame, frame_info))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        features_queue.put(_DONE)
+
+
+def _match_row(buffer, frames_data, i, method, block_size):
+    if method == "batched":
+        row = np.zeros(i, dtype=np.int32)
+        for start in range(0, i, block_size):
+            cols = np.arange(start, min(start + block_size, i))
+            row[cols] = match_block(buffer.packed, buffer.counts, i, cols)
+        return row
+
+    descriptors = frames_data[i]['descriptors']
+    return np.array([compare_frames(descriptors, frames_data[j]['descriptors']) for j in range(i)],
+                    dtype=np.int32)
+
+
+def stream_video_features(video_path, workers=4, queue_size=32, method="batched", block_size=32,
+                          keep_frames=True, reduction=1):
+    """Decode, extract features and match in one pass over the video, all in memory.
+
+    Frames flow through bounded queues from a decoder thread into ORB worker
+    threads; row i of the similarity matrix is matched against frames 0..i-1
+    as soon as frame i's descriptors arrive. With reduction > 1 ORB sees each
+    decoded frame as grayscale downscaled by that factor.
+    """
+    if method not in MATCHING_METHODS:
+        raise ValueError(f"Unknown matching method: {method}")
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        print(f"Error: Could not open video file {video_path}")
+        return None
+
+    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video.get(cv2.CAP_PROP_FPS)
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    print(f"Video Properties:")
+    print(f"  Total Frames: {total_frames}")
+    print(f"  FPS: {fps}")
+    print(f"  Resolution: {width}x{height}")
+    print(f"\nStreaming frames through {workers} feature workers ({method} matching)...")
+
+    frame_queue = queue.Queue(maxsize=queue_size)
+    features_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    threads = [threading.Thread(target=profile_thread(_decode_frames), args=(video, frame_queue, workers, errors),
+                                daemon=True)]
+    threads += [
+        threading.Thread(target=profile_thread(_extract_features), args=(frame_queue, features_queue, errors, reduction),
+                         daemon=True)
+        for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    frames_data = []
+    frames = []
+    rows = []
+    buffer = DescriptorBuffer()
+    pending = {}
+    finished_workers = 0
+
+    with tqdm(total=total_frames, desc="Streaming frames", unit="frame") as pbar:
+        while finished_workers < workers:
+            item = features_queue.get()
+            if item is _DONE:
+                finished_workers += 1
+                continue
+
+            index, frame, frame_info = item
+            pending[index] = (frame, frame_info)
+
+            # workers may finish out of order; match strictly in frame order
+            while len(frames_data) in pending:
+                frame, frame_info = pending.pop(len(frames_data))
+                i = len(frames_data)
+                frames_data.append(frame_info)
+                buffer.append(frame_info['descriptors'])
+                if keep_frames:
+                    frames.append(frame)
+                rows.append(_match_row(buffer, frames_data, i, method, block_size))
+                pbar.update(1)
+
+    for thread in threads[1:]:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    threads[0].join()
+    video.release()
+
+    n = len(frames_data)
+    similarity_matrix = np.zeros((n, n), dtype=np.int32)
+    for i, row in enumerate(rows):
+        similarity_matrix[i, :i] = row
+    similarity_matrix += similarity_matrix.T
+
+    print(f"\n Streamed {n} frames ({(n * (n - 1)) // 2} pairs matched)")
+    if frames_data:
+        warn_if_too_small(frames_data[0]['shape'], reduction)
+    count('frames_decoded', n)
+    count('frames_processed', n)
+    count('pairs_matched', (n * (n - 1)) // 2)
+    return frames_data, similarity_matrix, frames, fps, (width, height)
@@ -0,0 +1,145 @@
+import os
+import argparse
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+
+MOTIONS = ("mixed", "pan", "shapes", "static")
+
+# share of camera segments that hold still in "static" footage (long still shots, nothing moving in frame)
+STATIC_SHOT_FRACTION = 0.75
+
+
+def make_world(height, width, rng):
+    # multi-octave noise plus hard-edged shapes, so every window has ORB corners
+    world = np.zeros((height, width, 3), dtype=np.float32)
+    for scale in (64, 16, 4):
+        small = rng.random((max(height // scale, 2), max(width // scale, 2), 3), dtype=np.float32)
+        world += cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC) * (scale / 84.0)
+    world = np.clip(world * 255, 0, 255).astype(np.uint8)
+
+    for _ in range(width * height // 2000):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(3, 20))
+        if rng.random() < 0.5:
+            cv2.rectangle(world, (x, y), (x + size, y + size), color, -1)
+        else:
+            cv2.circle(world, (x, y), size // 2, color, -1)
+    return world
+
+
+def camera_path(n, pan_speed, static_fraction, rng):
+    # piecewise: pan segments alternate with static stretches where the camera holds still
+    offsets = np.zeros(n, dtype=np.float64)
+    t = 0
+    position = 0.0
+    while t < n:
+        length = int(rng.integers(20, 80))
+        speed = 0.0 if rng.random() < static_fraction else pan_speed * rng.uniform(0.5, 1.5)
+        for _ in range(min(length, n - t)):
+            offsets[t] = position
+            position += speed
+            t += 1
+    return offsets.astype(np.int64)
+
+
+def bounce(start, velocity, t, limit):
+    # position of a point moving at `velocity` that reflects off 0 and limit
+    period = 2 * limit
+    p = np.mod(start + velocity * t, period)
+    return np.where(p > limit, period - p, p)
+
+
+class SyntheticVideo:
+    """Deterministic synthetic footage: a textured world seen through a panning
+    camera, optional moving shapes on top, and a little per-frame sensor noise.
+
+    frame(i) depends only on (seed, i), so any frame can be regenerated to
+    check an ordering against the ground truth.
+    """
+
+    def __init__(self, n, width=320, height=180, motion="mixed", seed=0, pan_speed=3.0,
+                 static_fraction=0.2, num_shapes=6, noise=2.0):
+        if motion not in MOTIONS:
+            raise ValueError(f"Unknown motion: {motion}")
+        rng = np.random.default_rng(seed)
+        self.n = n
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.noise = noise
+
+        if motion == "shapes":
+            self.offsets = np.zeros(n, dtype=np.int64)
+        else:
+            still = {"mixed": static_fraction, "static": STATIC_SHOT_FRACTION}.get(motion, 0.0)
+            self.offsets = camera_path(n, pan_speed, still, rng)
+        self.world = make_world(height, width + int(self.offsets.max()) + 1, rng)
+
+        count = 0 if motion in ("pan", "static") else num_shapes
+        self.shape_start = rng.random((count, 2)) * [width, height]
+        self.shape_velocity = rng.uniform(-4, 4, (count, 2))
+        self.shape_size = rng.integers(8, 24, count)
+        self.shape_color = rng.integers(0, 256, (count, 3))
+
+    def frame(self, i):
+        x = int(self.offsets[i])
+        frame = self.world[:, x:x + self.width].copy()
+
+        xs = bounce(self.shape_start[:, 0], self.shape_velocity[:, 0], i, self.width - 1)
+        ys = bounce(self.shape_start[:, 1], self.shape_velocity[:, 1], i, self.height - 1)
+        for k in range(len(xs)):
+            cv2.circle(frame, (int(xs[k]), int(ys[k])), int(self.shape_size[k]),
+                       tuple(int(c) for c in self.shape_color[k]), -1)
+
+        if self.noise > 0:
+            rng = np.random.default_rng((self.seed, i))
+            noise = rng.normal(0, self.noise, frame.shape).astype(np.float32)
+            frame = np.clip(frame.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+        return frame
+
+
+def write_jumbled_video(output_path, video, fps=30, seed=0):
+    """Write video's frames in a random order; frame k of the output is frame
+    permutation[k] of the original. The permutation is returned and saved next
+    to the video as <output_path>.perm.npy."""
+    permutation = np.random.default_rng(seed).permutation(video.n)
+
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (video.width, video.height))
+    if not out.isOpened():
+        print(f"Error: Could not open video writer for {output_path}")
+        return None
+
+    for original in tqdm(permutation, desc="Writing jumbled video", unit="frame"):
+        out.write(video.frame(int(original)))
+    out.release()
+
+    np.save(output_path + ".perm.npy", permutation)
+    return permutation
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a deterministic jumbled synthetic video")
+    parser.add_argument("output", help="Output .mp4 path")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=180)
+    parser.add_argument("--motion", choices=MOTIONS, default="mixed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fps", type=int, default=30)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    video = SyntheticVideo(args.frames, width=args.width, height=args.height, motion=args.motion, seed=args.seed)
+    permutation = write_jumbled_video(args.output, video, fps=args.fps, seed=args.seed)
+    if permutation is not None:
+        print(f"Wrote {args.frames} jumbled frames to {args.output}")
+        print(f"Ground-truth permutation: {args.output}.perm.npy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import heapq
+import bisect
+import zlib
+import cv2
+from tqdm import tqdm
+from logger import count
+
+
+INDEX_VERSION = 1
+
+
+def frame_signature(frame):
+    # decoding is deterministic, so a checksum of a sparse pixel grid identifies a frame
+    return zlib.crc32(frame[::16, ::16].tobytes())
+
+
+def frame_number(filename):
+    # frame_00042.jpg -> 42, the frame's position in the source video
+    return int(re.search(r'(\d+)\D*$', filename).group(1))
+
+
+def index_path(video_path):
+    return video_path + ".index.json"
+
+
+def build_frame_index(video_path):
+    """One sequential decode pass: frame count, fps, resolution and a signature per
+    frame, used to verify that seeks land on the requested frame."""
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        print(f"Error: Could not open video file {video_path}")
+        return None
+
+    stat = os.stat(video_path)
+    index = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'fps': video.get(cv2.CAP_PROP_FPS),
+        'width': int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'signatures': []
+    }
+
+    with tqdm(total=int(video.get(cv2.CAP_PROP_FRAME_COUNT)), desc="Indexing video", unit="frame") as pbar:
+        while True:
+            success, frame = video.read()
+            if not success:
+                break
+            index['signatures'].append(frame_signature(frame))
+            pbar.update(1)
+
+    video.release()
+    index['num_frames'] = len(index['signatures'])
+    return index
+
+
+def load_frame_index(video_path):
+    # reuse the saved index while the video file is unchanged
+    path = index_path(video_path)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                index = json.load(f)
+            stat = os.stat(video_path)
+            if (index.get('version') == INDEX_VERSION and index['size'] == stat.st_size
+                    and index['mtime'] == stat.st_mtime):
+                return index
+        except Exception as e:
+            print(f"Warning: Could not read frame index ({e}), rebuilding")
+
+    index = build_frame_index(video_path)
+    if index is not None:
+        try:
+            with open(path, 'w') as f:
+                json.dump(index, f)
+        except Exception as e:
+            print(f"Warning: Could not save frame index: {e}")
+    return index
+
+
+class VideoFrameReader:
+    """Sequential reader over a video that can also jump to a frame number."""
+
+    def __init__(self, video_path, index):
+        self.video_path = video_path
+        self.index = index
+        self.video = cv2.VideoCapture(video_path)
+        self.position = 0
+        self.decoded = 0
+        self.seeks = 0
+        # signatures that occur once in the video identify the frame a seek landed on
+        occurrences = {}
+        for number, signature in enumerate(index['signatures']):
+            occurrences.setdefault(signature, []).append(number)
+        self.unique = {signature: numbers[0] for signature, numbers in occurrences.items() if len(numbers) == 1}
+        # frame numbers a seek is known to land on exactly, sorted
+        self.exact = []
+
+    def read_next(self):
+        success, frame = self.video.read()
+        if not success:
+            return None
+        self.position += 1
+        self.decoded += 1
+        return frame
+
+    def _set_position(self, target):
+        self.seeks += 1
+        self.video.set(cv2.CAP_PROP_POS_FRAMES, target)
+        self.position = target
+        frame = self.read_next()
+        if frame is None:
+            return None, None
+        signature = frame_signature(frame)
+        if signature == self.index['signatures'][target]:
+            if target not in self.exact:
+                bisect.insort(self.exact, target)
+            return frame, target
+        return frame, self.unique.get(signature)
+
+    def _decode_to(self, target, frame):
+        while self.position <= target:
+            frame = self.read_next()
+            if frame is None:
+                return None
+        return frame
+
+    def seek(self, target):
+        if target >= self.index['num_frames']:
+            return None
+        frame, landed = self._set_position(target)
+        if landed == target:
+            return frame
+
+        # the container could not seek exactly; inexact seeks usually land on an earlier
+        # keyframe, so decode forward from wherever it is recognisably at
+        if landed is not None and landed < target:
+            self.position = landed + 1
+            return self._decode_to(target, frame)
+
+        # otherwise from the closest earlier frame a seek once reached exactly
+        k = bisect.bisect_right(self.exact, target) - 1
+        if k >= 0:
+            frame, landed = self._set_position(self.exact[k])
+            if landed == self.exact[k]:
+                return self._decode_to(target, frame)
+
+        # nothing known before target: reopen and decode from the start
+        self.video.release()
+        self.video = cv2.VideoCapture(self.video_path)
+        self.position = 0
+        return self._decode_to(target, None)
+
+    def release(self):
+        self.video.release()
+
+
+def write_video_in_order(video_path, order, output_path, index, fps=None, cache_frames=64, max_forward_decode=250):
+    """Write source frames `order` (video frame numbers) to output_path.
+
+    Frames are decoded forward; any frame needed later is kept in a cache of at
+    most cache_frames frames, evicting the one needed furthest in the future
+    (Belady's MIN), and the reader only seeks when the next frame is neither
+    cached nor a short sequential decode ahead.
+    """
+    fps = fps or index['fps']
+    width, height = index['width'], index['height']
+    print(f"\nReconstructing video from {video_path}...")
+    print(f"Output: {output_path}")
+    print(f"FPS: {fps}")
+    print(f"Resolution: {width}x{height}, cache: {cache_frames} frames")
+
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not out.isOpened():
+        print(f"Error: Could not open video writer")
+        return False
+
+    needed_at = {frame: position for position, frame in enumerate(order)}
+    reader = VideoFrameReader(video_path, index)
+    cache = {}
+    written = 0
+    furthest = []  # max-heap of (-needed_at, frame); stale entries are skipped lazily
+
+    def offer(number, frame, position):
+        use = needed_at.get(number, -1)
+        if use <= position or number in cache:
+            return
+        if len(cache) >= cache_frames:
+            while furthest and furthest[0][1] not in cache:
+                heapq.heappop(furthest)
+            if not furthest or -furthest[0][0] <= use:
+                return
+            del cache[heapq.heappop(furthest)[1]]
+        cache[number] = frame
+        heapq.heappush(furthest, (-use, number))
+
+    def seek_start(target, position):
+        # seek a little before target when frames just behind it are needed soon,
+        # so one seek + forward decode fills the cache instead of one seek per frame
+        soon = [number for number in range(max(0, target - cache_frames), target)
+                if position < needed_at.get(number, -1) <= position + cache_frames and number not in cache]
+        return min(soon, default=target)
+
+    try:
+        for position, target in enumerate(tqdm(order, desc="Writing frames", unit="frame")):
+            frame = cache.pop(target, None)
+
+            if frame is None and (target < reader.position or target - reader.position > max_forward_decode):
+                start = seek_start(target, position)
+                decoded = reader.seek(start)
+                if start == target:
+                    frame = decoded
+                elif decoded is not None:
+                    offer(start, decoded, position)
+            while frame is None and reader.position <= target:
+                number = reader.position
+                decoded = reader.read_next()
+                if decoded is None:
+                    break
+                if number == target:
+                    frame = decoded
+                else:
+                    offer(number, decoded, position)
+
+            if frame is None:
+                print(f"Warning: Could not decode frame {target}, skipping...")
+                continue
+            out.write(frame)
+            written += 1
+    finally:
+        out.release()
+        reader.release()
+
+    print(f"  Decoded {reader.decoded} frames for {len(order)} written, {reader.seeks} seeks")
+    count('frames_decoded', reader.decoded)
+    count('frames_written', written)
+    count('seeks', reader.seeks)
+    print(f"\nVideo reconstruction complete!")
+    return True
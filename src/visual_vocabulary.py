@@ -0,0 +1,142 @@
+import numpy as np
+from tqdm import tqdm
+from hamming_matcher import DESCRIPTOR_BITS, signed_bits
+
+
+def sample_descriptors(frames_data, sample_size=50000, seed=0):
+    all_descriptors = [f['descriptors'] for f in frames_data if f['descriptors'] is not None]
+    if len(all_descriptors) == 0:
+        return np.zeros((0, DESCRIPTOR_BITS // 8), dtype=np.uint8)
+
+    stacked = np.concatenate(all_descriptors)
+    if len(stacked) > sample_size:
+        rng = np.random.default_rng(seed)
+        stacked = stacked[rng.choice(len(stacked), sample_size, replace=False)]
+    return stacked
+
+
+def nearest_words(descriptors, vocabulary_bits, chunk_size=4096):
+    words = np.empty(len(descriptors), dtype=np.int32)
+    for start in range(0, len(descriptors), chunk_size):
+        chunk = signed_bits(descriptors[start:start + chunk_size])
+        # largest +/-1 dot product == smallest Hamming distance
+        words[start:start + chunk_size] = (chunk @ vocabulary_bits.T).argmax(axis=1)
+    return words
+
+
+def train_vocabulary(descriptors, num_words=1024, iterations=10, seed=0):
+    """k-majority clustering: k-means under Hamming distance with bitwise-majority centroids."""
+    rng = np.random.default_rng(seed)
+    num_words = min(num_words, len(descriptors))
+    vocabulary = descriptors[rng.choice(len(descriptors), num_words, replace=False)].copy()
+    bits = np.unpackbits(descriptors, axis=1)
+
+    for _ in tqdm(range(iterations), desc="Training vocabulary", unit="iter"):
+        labels = nearest_words(descriptors, signed_bits(vocabulary))
+
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        words, starts, sizes = np.unique(sorted_labels, return_index=True, return_counts=True)
+        bit_sums = np.add.reduceat(bits[order].astype(np.int32), starts, axis=0)
+
+        majority = (2 * bit_sums >= sizes[:, None]).astype(np.uint8)
+        vocabulary[words] = np.packbits(majority, axis=1)
+
+        # re-seed words that lost all their descriptors
+        empty = np.setdiff1d(np.arange(num_words), words)
+        if len(empty) > 0:
+            vocabulary[empty] = descriptors[rng.choice(len(descriptors), len(empty), replace=False)]
+
+    return vocabulary
+
+
+def build_inverted_index(frames_data, vocabulary, max_document_frequency=0.5):
+    n = len(frames_data)
+    num_words = len(vocabulary)
+    vocabulary_bits = signed_bits(vocabulary)
+
+    frame_words = []
+    for frame_info in tqdm(frames_data, desc="Quantizing frames", unit="frame"):
+        if frame_info['descriptors'] is None:
+            frame_words.append((np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)))
+            continue
+        words, counts = np.unique(nearest_words(frame_info['descriptors'], vocabulary_bits),
+                                  return_counts=True)
+        frame_words.append((words.astype(np.int32), counts.astype(np.float32)))
+
+    document_frequency = np.zeros(num_words, dtype=np.int64)
+    for words, _ in frame_words:
+        document_frequency[words] += 1
+
+    # words seen in most frames carry no information and blow up posting lists
+    idf = np.log(n / np.maximum(document_frequency, 1)).astype(np.float32)
+    idf[document_frequency > max_document_frequency * n] = 0
+
+    frame_vectors = []
+    for words, counts in frame_words:
+        weights = counts * idf[words]
+        keep = weights > 0
+        words, weights = words[keep], weights[keep]
+        norm = np.linalg.norm(weights)
+        frame_vectors.append((words, weights / norm if norm > 0 else weights))
+
+    all_words = np.concatenate([w for w, _ in frame_vectors]) if n > 0 else np.zeros(0, dtype=np.int32)
+    all_frames = np.concatenate([np.full(len(w), i, dtype=np.int32) for i, (w, _) in enumerate(frame_vectors)]) \
+        if n > 0 else np.zeros(0, dtype=np.int32)
+    all_weights = np.concatenate([v for _, v in frame_vectors]) if n > 0 else np.zeros(0, dtype=np.float32)
+
+    order = np.argsort(all_words, kind='stable')
+    offsets = np.zeros(num_words + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(all_words, minlength=num_words))
+
+    return {
+        'frame_vectors': frame_vectors,
+        'posting_frames': all_frames[order],
+        'posting_weights': all_weights[order],
+        'offsets': offsets
+    }
+
+
+def query_neighbors(index, i, k):
+    words, weights = index['frame_vectors'][i]
+    if len(words) == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    offsets = index['offsets']
+    spans = [np.arange(offsets[w], offsets[w + 1]) for w in words]
+    postings = np.concatenate(spans)
+    scores = np.repeat(weights, [len(s) for s in spans]) * index['posting_weights'][postings]
+
+    # accumulate only over frames that share a word with frame i
+    frames, inverse = np.unique(index['posting_frames'][postings], return_inverse=True)
+    totals = np.bincount(inverse, weights=scores)
+
+    others = frames != i
+    frames, totals = frames[others], totals[others]
+    top = min(k, len(frames))
+    if top == 0:
+        return np.zeros(0, dtype=np.int32)
+    best = np.argpartition(-totals, top - 1)[:top]
+    return frames[best[np.argsort(-totals[best])]].astype(np.int32)
+
+
+def generate_candidate_pairs(frames_data, k=10, num_words=1024, sample_size=50000, iterations=10, seed=0):
+    """Top-k retrieval over a bag-of-visual-words index; returns unique (i, j) pairs with i < j."""
+    n = len(frames_data)
+    print(f"\nGenerating candidate pairs: top-{k} of {n} frames via a {num_words}-word visual vocabulary...")
+
+    descriptors = sample_descriptors(frames_data, sample_size=sample_size, seed=seed)
+    if len(descriptors) == 0 or n < 2:
+        return np.zeros((0, 2), dtype=np.int32)
+
+    vocabulary = train_vocabulary(descriptors, num_words=num_words, iterations=iterations, seed=seed)
+    index = build_inverted_index(frames_data, vocabulary)
+
+    pairs = []
+    for i in tqdm(range(n), desc="Retrieving neighbours", unit="frame"):
+        for j in query_neighbors(index, i, k):
+            pairs.append((min(i, j), max(i, j)))
+
+    pairs = np.unique(np.array(pairs, dtype=np.int32).reshape(-1, 2), axis=0)
+    print(f"  {len(pairs)} candidate pairs instead of {(n * (n - 1)) // 2}")
+    return pairs